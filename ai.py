@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+import openai
+import metrics
+import pager
+import response_cache
+from sessions import user_sessions
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+openai.api_key = OPENAI_API_KEY
+
+MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+# Stream tokens into the reply as they arrive (set to 0 to wait for the full answer)
+AI_STREAMING = os.getenv('AI_STREAMING', '1') != '0'
+# Minimum seconds between edits of the same reply; Telegram throttles frequent edits
+AI_EDIT_INTERVAL = float(os.getenv('AI_EDIT_INTERVAL', '1.0'))
+REPLY_PREFIX = "Deepanshu's assistant: "
+# Token budget for the remembered part of a conversation (summary + recent turns)
+AI_CONTEXT_TOKENS = int(os.getenv('AI_CONTEXT_TOKENS', '3000'))
+# Most recent turns that are never folded into the summary
+AI_KEEP_TURNS = int(os.getenv('AI_KEEP_TURNS', '4'))
+# Conversations idle longer than this (seconds) are forgotten
+AI_CONVERSATION_TTL = float(os.getenv('AI_CONVERSATION_TTL', '3600'))
+AI_MAX_CONVERSATIONS = int(os.getenv('AI_MAX_CONVERSATIONS', '500'))
+# Cached answers to repeated prompts; set AI_CACHE_PATH to keep them across restarts
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', '86400'))
+AI_CACHE_ENTRIES = int(os.getenv('AI_CACHE_ENTRIES', '1000'))
+AI_CACHE_PATH = os.getenv('AI_CACHE_PATH')
+IMAGE_SIZE = "512x512"
+
+_encoding = None
+_encoding_task = None
+
+
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # tiktoken is optional, and fetching its encoding can fail offline
+        return None
+
+
+async def load_encoding():
+    """Load the tokenizer in a thread on first use; the first call may download its data file."""
+    global _encoding, _encoding_task
+    if _encoding_task is None:
+        _encoding_task = asyncio.ensure_future(asyncio.to_thread(_get_encoding))
+    _encoding = await asyncio.shield(_encoding_task)
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Without tiktoken, roughly four characters per token
+    return len(text) // 4 + 1
+
+
+class Conversation:
+    """One user's remembered context: a running summary plus a window of recent turns."""
+
+    def __init__(self):
+        self.summary = ''
+        self.turns = []
+        self.last_used = time.monotonic()
+
+    @property
+    def tokens(self):
+        # Each chat message carries a few tokens of framing on top of its content
+        summary = count_tokens(self.summary) + 4 if self.summary else 0
+        return summary + sum(turn['tokens'] + 4 for turn in self.turns)
+
+    def add(self, role, content):
+        self.turns.append({'role': role, 'content': content, 'tokens': count_tokens(content)})
+
+    def messages(self, user_request):
+        messages = []
+        if self.summary:
+            messages.append({'role': 'system', 'content': f'Summary of the conversation so far: {self.summary}'})
+        messages.extend({'role': turn['role'], 'content': turn['content']} for turn in self.turns)
+        messages.append({'role': 'user', 'content': user_request})
+        return messages
+
+    async def compact(self, api_key, budget=AI_CONTEXT_TOKENS, keep=AI_KEEP_TURNS):
+        """Fold the oldest turns into the summary once the window exceeds its token budget."""
+        if self.tokens <= budget or len(self.turns) <= keep:
+            return
+        split = len(self.turns) - keep
+        old, self.turns = self.turns[:split], self.turns[split:]
+        transcript = '\n'.join(f"{turn['role']}: {turn['content']}" for turn in old)
+        prompt = f'Previous summary: {self.summary}\n\n{transcript}' if self.summary else transcript
+        try:
+            with metrics.timed('openai', 'summary'):
+                response = await openai.ChatCompletion.acreate(model=MODEL, api_key=api_key, messages=[
+                    {'role': 'system', 'content': 'Summarize this conversation in a few sentences, keeping facts, '
+                                                  'names, code identifiers and decisions the user may refer back to.'},
+                    {'role': 'user', 'content': prompt},
+                ])
+            self.summary = response.choices[0].message['content'].strip()
+        except Exception:
+            logger.exception('Conversation summary failed; dropping the oldest turns instead')
+        # The kept turns alone may still be over budget
+        while self.turns and self.tokens > budget:
+            self.turns.pop(0)
+
+
+class ConversationStore:
+    """Per-user conversations, evicted least-recently-used first and after AI_CONVERSATION_TTL idle seconds."""
+
+    def __init__(self, max_conversations=AI_MAX_CONVERSATIONS, ttl=AI_CONVERSATION_TTL):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_used <= self.ttl and len(self._conversations) <= self.max_conversations:
+                break
+            del self._conversations[user_id]
+
+    def get(self, user_id):
+        conversation = self._conversations.pop(user_id, None) or Conversation()
+        conversation.last_used = time.monotonic()
+        self._conversations[user_id] = conversation
+        self._evict()
+        return conversation
+
+    def peek(self, user_id):
+        self._evict()
+        return self._conversations.get(user_id)
+
+    def reset(self, user_id):
+        self._conversations.pop(user_id, None)
+
+
+conversations = ConversationStore()
+responses = response_cache.ResponseCache(AI_CACHE_ENTRIES, AI_CACHE_TTL, AI_CACHE_PATH)
+
+
+def split_text(text, limit=pager.TELEGRAM_LIMIT):
+    """Split text into Telegram-sized chunks, preferring to break at a newline."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """A reply that grows as text streams in.
+
+    Edits are coalesced to at most one per `interval` seconds; text past the
+    4096-character limit continues in follow-up messages.
+    """
+
+    def __init__(self, message, prefix='', interval=AI_EDIT_INTERVAL):
+        self.message = message
+        self.prefix = prefix
+        self.interval = interval
+        self.text = ''
+        self._sent = []
+        self._shown = []
+        self._next_edit = 0.0
+
+    async def start(self, placeholder='…'):
+        sent = await self.message.reply(self.prefix + placeholder)
+        self._sent.append(sent)
+        self._shown.append(None)
+
+    async def feed(self, token):
+        self.text += token
+        if time.monotonic() >= self._next_edit:
+            await self.flush()
+
+    async def flush(self, final=False):
+        chunks = split_text(self.prefix + self.text)
+        for i, chunk in enumerate(chunks):
+            if not chunk or (i < len(self._shown) and self._shown[i] == chunk):
+                continue
+            wait = await pager.send_or_defer(lambda: self._send(i, chunk), final)
+            if wait:
+                # Skip this round; the next flush after the wait catches up
+                self._next_edit = time.monotonic() + wait
+                return
+            self._shown[i] = chunk
+        self._next_edit = time.monotonic() + self.interval
+
+    async def _send(self, i, chunk):
+        if i < len(self._sent):
+            await self._sent[i].edit_text(chunk)
+        else:
+            self._sent.append(await self._sent[-1].reply(chunk))
+            self._shown.append(None)
+
+
+async def chat(message, messages, api_key):
+    """Answer `messages` in reply to `message`, streaming when enabled. Returns the full text."""
+    started = time.monotonic()
+    if not AI_STREAMING:
+        with metrics.timed('openai', 'chat'):
+            response = await openai.ChatCompletion.acreate(model=MODEL, messages=messages, api_key=api_key)
+        text = response.choices[0].message['content'].strip()
+        logger.info('AI reply: %d chars in %.2fs (no streaming)', len(text), time.monotonic() - started)
+        for chunk in split_text(REPLY_PREFIX + text):
+            await message.reply(chunk)
+        return text
+
+    reply = StreamingReply(message, REPLY_PREFIX)
+    await reply.start()
+    first_token = None
+    with metrics.timed('openai', 'chat_stream'):
+        stream = await openai.ChatCompletion.acreate(model=MODEL, messages=messages, api_key=api_key, stream=True)
+        async for chunk in stream:
+            token = chunk['choices'][0]['delta'].get('content')
+            if not token:
+                continue
+            if first_token is None:
+                first_token = time.monotonic() - started
+                metrics.observe('openai', 'first_token', first_token)
+            await reply.feed(token)
+    reply.text = reply.text.strip()
+    await reply.flush(final=True)
+    logger.info('AI reply: first token after %.2fs, %d chars in %.2fs',
+                first_token or 0.0, len(reply.text), time.monotonic() - started)
+    return reply.text
+
+
+async def converse(message, user_id, user_request, api_key):
+    """Answer with the user's remembered context, then record the exchange."""
+    await load_encoding()
+    conversation = conversations.get(user_id)
+    # Only context-free prompts are cacheable; with history (or its summary) the answer depends on it
+    fresh = not conversation.turns and not conversation.summary
+    key = response_cache.make_key('chat', MODEL, user_request) if fresh else None
+    text = responses.get(key) if key else None
+    if text is not None:
+        for chunk in split_text(REPLY_PREFIX + text):
+            await message.reply(chunk)
+    else:
+        text = await chat(message, conversation.messages(user_request), api_key)
+        if key and text:
+            responses.set(key, text)
+    conversation.add('user', user_request)
+    conversation.add('assistant', text)
+    # Summarizing happens after the reply is out, so it never delays the answer
+    await conversation.compact(api_key)
+    return text
+
+
+async def reset_conversation(client, message):
+    conversations.reset(message.from_user.id)
+    await message.reply('Conversation reset.')
+
+
+async def conversation_usage(client, message):
+    conversation = conversations.peek(message.from_user.id)
+    if conversation is None:
+        await message.reply(f'No conversation yet. Budget: {AI_CONTEXT_TOKENS} tokens.')
+        return
+    await message.reply(f'Conversation: {len(conversation.turns)} recent turns'
+                        f"{', with summary' if conversation.summary else ''}\n"
+                        f'Using {conversation.tokens} of {AI_CONTEXT_TOKENS} tokens '
+                        f'({100 * conversation.tokens / AI_CONTEXT_TOKENS:.0f}%).')
+
+
+def cache_stats():
+    stats = responses.stats()
+    disk = f", on disk: {stats['disk_entries']}" if 'disk_entries' in stats else ''
+    return ('AI response cache:\n'
+            f"hits: {stats['hits'] + stats['disk_hits']} (memory: {stats['hits']}, disk: {stats['disk_hits']}), "
+            f"misses: {stats['misses']}\n"
+            f"entries: {stats['entries']}{disk}")
+
+
+async def image(message, prompt, api_key):
+    key = response_cache.make_key('image', f'dall-e:{IMAGE_SIZE}', prompt)
+    file_id = responses.get(key)
+    if file_id is not None:
+        try:
+            # Re-send the photo Telegram already has; no OpenAI call and no upload
+            return await message.reply_photo(file_id)
+        except Exception:
+            logger.warning('Cached image file_id was rejected; generating a new image')
+            responses.discard(key)
+
+    with metrics.timed('openai', 'image'):
+        response = await openai.Image.acreate(prompt=prompt, n=1, size=IMAGE_SIZE, api_key=api_key)
+    image_url = response['data'][0]['url']
+    sent = await message.reply_photo(image_url)
+    if sent is not None and sent.photo is not None:
+        responses.set(key, sent.photo.file_id)
+    return sent
+
+
+async def handle_request(client, message):
+    """Answer an owner message containing 'dk ai'; 'dk ai image: ...' generates a picture."""
+    user_id = message.from_user.id
+    api_key = user_sessions.get(user_id).get('openai_api_key', OPENAI_API_KEY)
+    user_request = message.text.replace('dk ai', '').strip()
+
+    try:
+        if user_request.lower().startswith('image:'):
+            description = user_request[len('image:'):].strip()
+            await image(message, description, api_key)
+        else:
+            await converse(message, user_id, user_request, api_key)
+    except Exception as e:
+        await message.reply(f'Error: {str(e)}')
@@ -0,0 +1,28 @@
+import asyncio
+import aiohttp
+
+
+class PooledClient:
+    """Base for the HTTP API clients: one lazily opened aiohttp session, shared by every call.
+
+    At most `max_in_flight` requests run at once (hold `_slots` around each),
+    and the connection pool keeps the same number of keep-alive connections.
+    """
+
+    def __init__(self, base_url, max_in_flight, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
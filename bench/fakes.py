@@ -0,0 +1,91 @@
+"""Minimal stand-ins for the Pyrogram objects the handlers touch."""
+import itertools
+
+_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakePhoto:
+    def __init__(self):
+        self.file_id = f'photo-{next(_ids)}'
+
+
+class FakeMessage:
+    """Records every reply and edit instead of talking to Telegram."""
+
+    def __init__(self, text=None, user_id=0, chat_id=0, caption=None, document=None):
+        self.id = next(_ids)
+        self.text = text
+        self.caption = caption
+        self.document = document
+        self.media_group_id = None
+        self.reply_to_message = None
+        self.from_user = FakeUser(user_id)
+        self.chat = FakeChat(chat_id)
+        self.photo = None
+        self.replies = []
+        self.edits = 0
+
+    def _child(self, text=None):
+        child = FakeMessage(text, self.from_user.id, self.chat.id)
+        self.replies.append(child)
+        return child
+
+    async def reply(self, text, reply_markup=None, **kwargs):
+        return self._child(text)
+
+    async def reply_photo(self, photo, **kwargs):
+        child = self._child()
+        child.photo = FakePhoto()
+        return child
+
+    async def reply_document(self, document, caption=None, **kwargs):
+        return self._child(caption)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        self.text = text
+        self.edits += 1
+        return self
+
+    edit = edit_text
+
+    def failed(self):
+        """True if any reply (at any depth) reports an error."""
+        return any((reply.text or '').startswith('Error') or reply.failed() for reply in self.replies)
+
+
+class FakeDocument:
+    def __init__(self, file_name, data):
+        self.file_name = file_name
+        self.data = data
+        self.file_size = len(data)
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, message):
+        self.data = data
+        self.message = message
+        self.from_user = message.from_user
+        self.answers = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+
+class FakeClient:
+    async def get_media_group(self, chat_id, message_id):
+        return []
+
+    async def stream_media(self, message, limit=0, offset=0):
+        data = message.document.data
+        for start in range(0, len(data), 1024 * 1024):
+            yield data[start:start + 1024 * 1024]
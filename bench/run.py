@@ -0,0 +1,299 @@
+"""Offline load test for the bot's handlers.
+
+Drives the real handlers in main.py and github.py with fake Pyrogram objects
+against local stand-ins for GitHub, OpenAI, Heroku and the git CLI, then
+reports throughput, latency percentiles per operation and the longest
+event-loop stall. Needs no network access.
+
+    python bench/run.py --requests 500 --concurrency 50
+    python bench/run.py --mix view_file=5,ai=2 --github-latency 0.1 --json before.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fakes import FakeCallbackQuery, FakeClient, FakeDocument, FakeMessage  # noqa: E402
+import stubs  # noqa: E402
+
+OWNER_ID = 1000
+REPO = 'bench/repo-0000'
+
+DEFAULT_MIX = {
+    'view_file': 4,
+    'view_big': 1,
+    'edit_file': 1,
+    'upload': 0.5,
+    'download': 0.5,
+    'list_repos': 2,
+    'status': 1,
+    'logs': 1,
+    'exec': 1,
+    'ai': 3,
+    'image': 1,
+    'callback': 2,
+    'start': 1,
+    'deploy': 0.2,
+    'chatter': 4,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help='total updates to replay')
+    parser.add_argument('--concurrency', type=int, default=30, help='updates in flight at once')
+    parser.add_argument('--bursts', type=int, default=1, help='split the traffic into this many bursts')
+    parser.add_argument('--burst-gap', type=float, default=1.0, help='seconds between bursts')
+    parser.add_argument('--mix', help='weights like view_file=3,ai=2 (default: a mix of everything)')
+    parser.add_argument('--github-latency', type=float, default=0.05)
+    parser.add_argument('--openai-latency', type=float, default=0.3, help='delay before the first token')
+    parser.add_argument('--token-latency', type=float, default=0.01, help='delay between streamed tokens')
+    parser.add_argument('--heroku-latency', type=float, default=0.03)
+    parser.add_argument('--build-seconds', type=float, default=1.0, help='how long each Heroku build runs')
+    parser.add_argument('--cli-latency', type=float, default=0.2, help='run time of each fake git call')
+    parser.add_argument('--workers', type=int, default=0, help='WORKER_PROCESSES for offloaded CPU work')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser.parse_args()
+
+
+def parse_mix(text):
+    if not text:
+        return DEFAULT_MIX
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'Unknown operation {name!r}; choose from {", ".join(DEFAULT_MIX)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def configure_env(args, workdir, github_url, heroku_url):
+    bin_dir = os.path.join(workdir, 'bin')
+    stubs.install_fake_cli(bin_dir, args.cli_latency)
+    os.environ.update({
+        'API_ID': '1',
+        'API_HASH': 'bench',
+        'TOKEN': '1:bench',
+        'OWNER_ID': str(OWNER_ID),
+        'OPENAI_API_KEY': 'sk-bench',
+        'GITHUB_TOKEN': 'ghp_bench',
+        'GITHUB_API_URL': github_url,
+        'HEROKU_API_URL': heroku_url,
+        'HEROKU_BUILD_POLL': '0.2',
+        'SESSION_DB': os.path.join(workdir, 'sessions.db'),
+        'MIRROR_ROOT': os.path.join(workdir, 'mirrors'),
+        'WORKER_PROCESSES': str(args.workers),
+        'LOG_LEVEL': 'WARNING',
+        'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+    })
+    os.chdir(workdir)
+
+
+def operations(main):
+    client = FakeClient()
+
+    async def deliver(msg):
+        # What Pyrogram does per update: run the router's filter, then the handler
+        if await main.router.filter(client, msg):
+            await main.router.dispatch(client, msg)
+
+    def op(text, user_id=OWNER_ID):
+        msg = FakeMessage(text, user_id=user_id, chat_id=user_id)
+        return msg, deliver(msg)
+
+    upload_data = os.urandom(2 * 1024 * 1024)
+
+    def upload(i):
+        document = FakeDocument(f'upload-{i}.bin', upload_data)
+        msg = FakeMessage(None, user_id=OWNER_ID, chat_id=OWNER_ID, caption=f'/upload {REPO} uploads/', document=document)
+        return msg, deliver(msg)
+
+    def callback(i):
+        msg = FakeMessage('menu', user_id=OWNER_ID, chat_id=OWNER_ID)
+        return msg, main.button(client, FakeCallbackQuery(['deploy', 'ai', 'github'][i % 3], msg))
+
+    return {
+        # Short repo name, resolved through the repo index
+        'view_file': lambda i: op(f"/view_file {REPO.split('/')[1]} README.md"),
+        'view_big': lambda i: op(f'/view_file {REPO} big.txt'),
+        'edit_file': lambda i: op(f'/edit_file {REPO} notes.txt revision {i}'),
+        'upload': upload,
+        'download': lambda i: op(f'/download {REPO} big.txt'),
+        'list_repos': lambda i: op('/list_repos' if i % 2 else '/list_repos repo-01'),
+        'status': lambda i: op('/status'),
+        'logs': lambda i: op('/logs -n 50'),
+        'exec': lambda i: op('/exec echo bench'),
+        'ai': lambda i: op(f'dk ai question number {i % 20}'),
+        'image': lambda i: op(f'dk ai image: a cat number {i % 5}'),
+        'callback': callback,
+        'start': lambda i: op('/start'),
+        'deploy': lambda i: op(f'/deploy https://github.com/bench/repo-{i % 3}'),
+        # Group chatter and commands from other users; the router should drop these for free
+        'chatter': lambda i: op(f'just talking about dk ai number {i}' if i % 2 else '/exec ls', user_id=2000 + i),
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StallMonitor:
+    """Samples the event loop every few milliseconds and keeps the worst delay."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_stall = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_stall = max(self.max_stall, time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+async def run(args):
+    latency = stubs.Latency(args.github_latency, args.openai_latency, args.token_latency, args.cli_latency,
+                            args.heroku_latency, args.build_seconds)
+    github = stubs.GitHubStub(latency, files={
+        'README.md': b'# Bench\n' + b'Some text.\n' * 50,
+        'big.txt': b'0123456789abcdef\n' * 20000,
+        'notes.txt': b'notes\n',
+    })
+    openai_stub = stubs.OpenAIStub(latency)
+    github_runner, github_url = await stubs.serve(github.app())
+    openai_runner, openai_url = await stubs.serve(openai_stub.app())
+    heroku_stub = stubs.HerokuStub(latency)
+    heroku_runner, heroku_url = await stubs.serve(heroku_stub.app())
+
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    configure_env(args, workdir, github_url, heroku_url)
+
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+    import deploys
+    import github_api
+    import heroku_api
+    import metrics
+    import openai
+    import workers
+    openai.api_base = f'{openai_url}/v1'
+    workers.start()
+    main.user_sessions.set(OWNER_ID, 'heroku_api_key', 'heroku-bench')
+    main.user_sessions.set(OWNER_ID, 'app_name', 'bench-app')
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    names = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    ops = operations(main)
+    results = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(i, name):
+        async with slots:
+            msg, coro = ops[name](i)
+            t0 = time.perf_counter()
+            try:
+                await coro
+                failed = msg.failed()
+            except Exception:
+                failed = True
+            results[name].append(time.perf_counter() - t0)
+            errors[name] += failed
+
+    monitor = StallMonitor()
+    monitor.start()
+    await metrics.start()
+    t0 = time.perf_counter()
+    per_burst = -(-len(names) // args.bursts)
+    for burst in range(args.bursts):
+        if burst:
+            await asyncio.sleep(args.burst_gap)
+        chunk = range(burst * per_burst, min(len(names), (burst + 1) * per_burst))
+        await asyncio.gather(*[one(i, names[i]) for i in chunk])
+    wall = time.perf_counter() - t0
+    deploy_jobs = deploys.scheduler.list()
+    await asyncio.gather(*[job.task for job in deploy_jobs], return_exceptions=True)
+    deploy_wall = time.perf_counter() - t0
+    monitor.stop()
+    await metrics.stop()
+
+    report = {
+        'requests': len(names),
+        'concurrency': args.concurrency,
+        'wall_seconds': wall,
+        'throughput': len(names) / wall if wall else 0.0,
+        'max_loop_stall_ms': monitor.max_stall * 1000,
+        'import_main_seconds': import_seconds,
+        'deploy_jobs': len(deploy_jobs),
+        'deploy_states': dict(collections.Counter(job.state for job in deploy_jobs)),
+        'deploys_done_seconds': deploy_wall,
+        'github_requests': github.requests,
+        'openai_requests': openai_stub.requests,
+        'heroku_requests': heroku_stub.requests,
+        'operations': {
+            name: {
+                'count': len(values),
+                'errors': errors[name],
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': max(values, default=0.0) * 1000,
+            }
+            for name, values in results.items() if values
+        },
+    }
+
+    await github_api.api.close()
+    await heroku_api.client.close()
+    workers.shutdown()
+    await github_runner.cleanup()
+    await openai_runner.cleanup()
+    await heroku_runner.cleanup()
+    return report
+
+
+def print_report(report):
+    print(f"{report['requests']} updates at concurrency {report['concurrency']} in {report['wall_seconds']:.2f}s "
+          f"-> {report['throughput']:.1f} updates/s")
+    print(f"max event-loop stall: {report['max_loop_stall_ms']:.1f}ms   import main: {report['import_main_seconds']:.2f}s")
+    print(f"stub traffic: {report['github_requests']} GitHub, {report['openai_requests']} OpenAI, "
+          f"{report['heroku_requests']} Heroku requests")
+    if report['deploy_jobs']:
+        print(f"{report['deploy_jobs']} deploy jobs finished after {report['deploys_done_seconds']:.2f}s: "
+              f"{', '.join(f'{count} {state}' for state, count in report['deploy_states'].items())}")
+    print()
+    print(f"{'operation':<12}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in sorted(report['operations'].items()):
+        print(f"{name:<12}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,81 @@
+"""Cold-start cost of the bot: time and memory to import main.py, as a fresh dyno pays it.
+
+Each run imports main in a new interpreter (no Telegram connection is made)
+and reports the import time, peak RSS, how many modules were loaded and which
+of the heavy optional ones were among them.
+
+    python bench/startup.py --runs 10
+    python bench/startup.py --json after.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('openai', 'aiohttp', 'requests', 'tiktoken', 'github', 'github_api', 'ai', 'deploys', 'mirrors', 'log_tail')
+
+PROBE = f'''
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+seconds = time.perf_counter() - started
+print(json.dumps({{
+    'seconds': seconds,
+    'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'heavy': [name for name in {HEAVY!r} if name in sys.modules],
+}}))
+'''
+
+
+def probe(env):
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bot-startup-')
+    env = {
+        **os.environ,
+        'API_ID': '1',
+        'API_HASH': 'bench',
+        'TOKEN': '1:bench',
+        'OWNER_ID': '1000',
+        'OPENAI_API_KEY': 'sk-bench',
+        'SESSION_DB': os.path.join(workdir, 'sessions.db'),
+        'PYTHONDONTWRITEBYTECODE': '1',
+    }
+    # The first run also fills the OS file cache; it is reported separately
+    first = probe(env)
+    runs = [probe(env) for _ in range(args.runs)]
+    seconds = [run['seconds'] for run in runs]
+    report = {
+        'first_seconds': first['seconds'],
+        'median_seconds': statistics.median(seconds),
+        'min_seconds': min(seconds),
+        'max_rss_mib': max(run['max_rss_kib'] for run in runs) / 1024,
+        'modules': runs[-1]['modules'],
+        'heavy_modules': runs[-1]['heavy'],
+    }
+
+    print(f"import main: median {report['median_seconds'] * 1000:.0f}ms, min {report['min_seconds'] * 1000:.0f}ms "
+          f"over {args.runs} runs (first run {report['first_seconds'] * 1000:.0f}ms)")
+    print(f"peak RSS {report['max_rss_mib']:.1f} MiB, {report['modules']} modules loaded")
+    print(f"heavy modules loaded at startup: {', '.join(report['heavy_modules']) or 'none'}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
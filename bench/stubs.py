@@ -0,0 +1,358 @@
+"""Local stand-ins for the GitHub, OpenAI and Heroku Platform APIs and the git CLI, with injectable latency."""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import stat
+import time
+import uuid
+from aiohttp import web
+
+# Uploads of blobs and source tarballs can be far larger than aiohttp's 1 MB default
+MAX_BODY = 200 * 1024 * 1024
+
+
+class Latency:
+    def __init__(self, github=0.05, openai=0.3, token=0.01, cli=0.2, heroku=0.03, build=1.0):
+        self.github = github
+        self.openai = openai
+        self.token = token
+        self.cli = cli
+        self.heroku = heroku
+        # How long a Heroku build stays pending
+        self.build = build
+
+
+def _sha(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class GitHubStub:
+    """Enough of the contents, repos and Git Data endpoints for the bot's GitHub commands."""
+
+    def __init__(self, latency, repos=200, files=None):
+        self.latency = latency
+        self.repos = [{'full_name': f'bench/repo-{i:04d}', 'name': f'repo-{i:04d}',
+                       'updated_at': '2024-01-01T00:00:00Z'} for i in range(repos)]
+        self.files = {}
+        for path, content in (files or {}).items():
+            self.files[('bench/repo-0000', path)] = content
+        self.blobs = {}
+        self.requests = 0
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=MAX_BODY)
+        app.router.add_get('/user/repos', self.list_repos)
+        app.router.add_post('/user/repos', self.create_repo)
+        app.router.add_route('*', '/repos/{owner}/{repo}/contents/{path:.*}', self.contents)
+        app.router.add_get('/repos/{owner}/{repo}', self.repo)
+        app.router.add_route('*', '/repos/{owner}/{repo}/git/{rest:.*}', self.git_data)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests += 1
+        await asyncio.sleep(self.latency.github)
+        response = await handler(request)
+        response.headers['X-RateLimit-Limit'] = '5000'
+        response.headers['X-RateLimit-Remaining'] = '4999'
+        response.headers['X-RateLimit-Reset'] = str(int(time.time()) + 3600)
+        return response
+
+    async def list_repos(self, request):
+        per_page = int(request.query.get('per_page', 30))
+        page = int(request.query.get('page', 1))
+        repos = self.repos
+        if request.query.get('sort') == 'updated':
+            repos = sorted(repos, key=lambda repo: repo['updated_at'], reverse=True)
+        chunk = repos[(page - 1) * per_page:page * per_page]
+        etag = f'"{_sha(json.dumps(chunk).encode())}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        headers = {'ETag': etag}
+        last = max(1, -(-len(repos) // per_page))
+        if page < last:
+            query = '&'.join(f'{key}={value}' for key, value in request.query.items() if key != 'page')
+            base = f'{request.scheme}://{request.host}{request.path}?{query}'
+            headers['Link'] = f'<{base}&page={page + 1}>; rel="next", <{base}&page={last}>; rel="last"'
+        return web.json_response(chunk, headers=headers)
+
+    async def create_repo(self, request):
+        body = await request.json()
+        repo = {'full_name': f"bench/{body['name']}", 'name': body['name'], 'updated_at': '2024-01-02T00:00:00Z'}
+        self.repos.append(repo)
+        return web.json_response(repo, status=201)
+
+    async def repo(self, request):
+        return web.json_response({'default_branch': 'main'})
+
+    async def contents(self, request):
+        repo = f"{request.match_info['owner']}/{request.match_info['repo']}"
+        key = (repo, request.match_info['path'])
+        if request.method == 'GET':
+            if key not in self.files:
+                return web.json_response({'message': 'Not Found'}, status=404)
+            content = self.files[key]
+            etag = f'"{_sha(content)}"'
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304)
+            if request.headers.get('Accept', '').endswith('.raw'):
+                return web.Response(body=content, headers={'ETag': etag})
+            return web.json_response({'content': base64.b64encode(content).decode('ascii'), 'sha': _sha(content)},
+                                     headers={'ETag': etag})
+
+        body = await request.json()
+        if request.method == 'DELETE':
+            self.files.pop(key, None)
+            return web.json_response({'commit': {}})
+        created = key not in self.files
+        content = base64.b64decode(body['content'])
+        self.files[key] = content
+        return web.json_response({'content': {'sha': _sha(content)}}, status=201 if created else 200)
+
+    def _tree(self, request, sha):
+        # 'tree' is the root; subdirectories get the sha 'tree:<path>'
+        repo = f"{request.match_info['owner']}/{request.match_info['repo']}"
+        prefix = sha[len('tree:'):] + '/' if sha.startswith('tree:') else ''
+        entries = {}
+        for (name, path), content in self.files.items():
+            if name != repo or not path.startswith(prefix):
+                continue
+            entry, nested, _ = path[len(prefix):].partition('/')
+            if nested:
+                entries[entry] = {'path': entry, 'mode': '040000', 'type': 'tree', 'sha': f'tree:{prefix}{entry}'}
+            else:
+                entries[entry] = {'path': entry, 'mode': '100644', 'type': 'blob', 'sha': _sha(content)}
+        return list(entries.values())
+
+    async def git_data(self, request):
+        rest = request.match_info['rest']
+        if request.method == 'GET' and rest.startswith('ref/'):
+            return web.json_response({'object': {'sha': 'head'}})
+        if request.method == 'GET' and rest.startswith('commits/'):
+            return web.json_response({'tree': {'sha': 'tree'}})
+        if request.method == 'GET' and rest.startswith('trees/'):
+            return web.json_response({'tree': self._tree(request, rest[len('trees/'):])})
+        body = await request.read()
+        digest = _sha(body)
+        if rest == 'blobs':
+            content = base64.b64decode(json.loads(body)['content'])
+            digest = _sha(content)
+            self.blobs[digest] = content
+        if request.method == 'PATCH':
+            return web.json_response({'object': {'sha': json.loads(body)['sha']}})
+        return web.json_response({'sha': digest}, status=201)
+
+
+class OpenAIStub:
+    def __init__(self, latency, tokens=40):
+        self.latency = latency
+        self.tokens = tokens
+        self.requests = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat)
+        app.router.add_post('/v1/images/generations', self.image)
+        return app
+
+    async def chat(self, request):
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency.openai)
+        words = [f'word{i} ' for i in range(self.tokens)]
+        if not body.get('stream'):
+            await asyncio.sleep(self.latency.token * self.tokens)
+            return web.json_response({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)},
+                                                   'finish_reason': 'stop'}]})
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for word in words:
+            await asyncio.sleep(self.latency.token)
+            chunk = {'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]}
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def image(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency.openai)
+        return web.json_response({'data': [{'url': 'https://example.invalid/image.png'}]})
+
+
+class HerokuStub:
+    """Apps, dynos, releases, sources, builds and log sessions of the Heroku Platform API.
+
+    Builds whose source tarball is empty fail; all others succeed after `latency.build` seconds.
+    """
+
+    def __init__(self, latency, log_lines=50):
+        self.latency = latency
+        self.log_lines = log_lines
+        self.apps = {'bench-app'}
+        self.blobs = {}
+        self.builds = {}
+        self.requests = 0
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=MAX_BODY)
+        app.router.add_post('/apps', self.create_app)
+        app.router.add_get('/apps/{app}', self.get_app)
+        app.router.add_get('/apps/{app}/dynos', self.dynos)
+        app.router.add_get('/apps/{app}/formation', self.formation)
+        app.router.add_get('/apps/{app}/releases', self.releases)
+        app.router.add_post('/sources', self.create_source)
+        app.router.add_route('*', '/blobs/{id}', self.blob)
+        app.router.add_post('/apps/{app}/builds', self.create_build)
+        app.router.add_get('/apps/{app}/builds/{id}', self.get_build)
+        app.router.add_post('/apps/{app}/log-sessions', self.log_session)
+        app.router.add_get('/streams/logs', self.log_stream)
+        app.router.add_get('/streams/builds/{id}', self.build_stream)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests += 1
+        # Pre-signed URLs (blobs, streams) carry no API key
+        if not request.path.startswith(('/blobs/', '/streams/')):
+            if not request.headers.get('Authorization', '').startswith('Bearer '):
+                return web.json_response({'id': 'unauthorized', 'message': 'Invalid credentials provided.'}, status=401)
+            await asyncio.sleep(self.latency.heroku)
+        return await handler(request)
+
+    def _base(self, request):
+        return f'{request.scheme}://{request.host}'
+
+    def _missing(self, request):
+        if request.match_info['app'] not in self.apps:
+            return web.json_response({'id': 'not_found', 'message': "Couldn't find that app."}, status=404)
+        return None
+
+    async def create_app(self, request):
+        body = await request.json()
+        self.apps.add(body['name'])
+        return web.json_response({'id': str(uuid.uuid4()), 'name': body['name']}, status=201)
+
+    async def get_app(self, request):
+        return self._missing(request) or web.json_response({'id': 'app', 'name': request.match_info['app']})
+
+    async def dynos(self, request):
+        return self._missing(request) or web.json_response([
+            {'name': f'web.{i}', 'type': 'web', 'size': 'Basic', 'command': 'python supervisor.py',
+             'state': 'up', 'updated_at': '2024-01-01T00:00:00Z'} for i in (1, 2)
+        ])
+
+    async def formation(self, request):
+        return self._missing(request) or web.json_response([
+            {'type': 'web', 'quantity': 2, 'size': 'Basic', 'command': 'python supervisor.py'}
+        ])
+
+    async def releases(self, request):
+        return self._missing(request) or web.json_response([
+            {'version': 10 - i, 'description': f'Deploy {i}', 'status': 'succeeded'} for i in range(3)
+        ])
+
+    async def create_source(self, request):
+        blob_id = str(uuid.uuid4())
+        url = f'{self._base(request)}/blobs/{blob_id}'
+        return web.json_response({'source_blob': {'get_url': url, 'put_url': url}}, status=201)
+
+    async def blob(self, request):
+        blob_id = request.match_info['id']
+        if request.method == 'PUT':
+            self.blobs[blob_id] = await request.read()
+            return web.Response(status=200)
+        return web.Response(body=self.blobs.get(blob_id, b''))
+
+    async def create_build(self, request):
+        missing = self._missing(request)
+        if missing:
+            return missing
+        body = await request.json()
+        blob_id = body['source_blob']['url'].rsplit('/', 1)[-1]
+        build_id = str(uuid.uuid4())
+        self.builds[build_id] = {
+            'id': build_id,
+            'status': 'pending',
+            'ready_at': time.monotonic() + self.latency.build,
+            'result': 'succeeded' if self.blobs.get(blob_id) else 'failed',
+            'output_stream_url': f'{self._base(request)}/streams/builds/{build_id}',
+        }
+        return web.json_response(self._build_view(self.builds[build_id]), status=201)
+
+    def _build_view(self, build):
+        status = build['result'] if time.monotonic() >= build['ready_at'] else 'pending'
+        return {'id': build['id'], 'status': status, 'output_stream_url': build['output_stream_url']}
+
+    async def get_build(self, request):
+        build = self.builds.get(request.match_info['id'])
+        if build is None:
+            return web.json_response({'id': 'not_found', 'message': "Couldn't find that build."}, status=404)
+        return web.json_response(self._build_view(build))
+
+    async def build_stream(self, request):
+        build = self.builds[request.match_info['id']]
+        lines = ['-----> Building on the Heroku-22 stack', '-----> Python app detected']
+        if build['result'] == 'failed':
+            lines.append(' !     Push rejected, no Cedar-supported app detected')
+        return web.Response(text='\n'.join(lines) + '\n')
+
+    async def log_session(self, request):
+        missing = self._missing(request)
+        if missing:
+            return missing
+        body = await request.json()
+        lines = body.get('lines', 100)
+        url = f"{self._base(request)}/streams/logs?lines={lines}&tail={int(bool(body.get('tail')))}"
+        return web.json_response({'id': str(uuid.uuid4()), 'logplex_url': url}, status=201)
+
+    async def log_stream(self, request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/plain'})
+        await response.prepare(request)
+        for i in range(min(int(request.query['lines']), self.log_lines)):
+            await response.write(f'2024-01-01T00:00:00+00:00 app[web.1]: bench line {i}\n'.encode('utf-8'))
+        if request.query['tail'] == '1':
+            # A live tail: one line a tenth of a second until the client hangs up
+            i = 0
+            try:
+                while True:
+                    await asyncio.sleep(0.1)
+                    await response.write(f'2024-01-01T00:00:00+00:00 app[web.1]: live line {i}\n'.encode('utf-8'))
+                    i += 1
+            except ConnectionResetError:
+                return response
+        await response.write_eof()
+        return response
+
+
+FAKE_CLI = '''#!/bin/sh
+# Stand-in for the real CLI: wait, then do the minimum the bot relies on
+sleep {latency}
+case "$1" in
+  clone) for last; do :; done; mkdir -p "$last" ;;
+  rev-parse) echo 0123456789abcdef0123456789abcdef01234567 ;;
+  archive) prev=; for arg; do [ "$prev" = -o ] && echo "fake tarball" > "$arg"; prev=$arg; done ;;
+esac
+exit 0
+'''
+
+
+def install_fake_cli(directory, latency):
+    """Write a fake `git` executable into `directory` (to be put first on PATH)."""
+    os.makedirs(directory, exist_ok=True)
+    for name in ('git',):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(FAKE_CLI.format(latency=latency))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+async def serve(app, host='127.0.0.1', port=0):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://{host}:{port}'
@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+import heroku_api
+import mirrors
+
+logger = logging.getLogger(__name__)
+
+# Deploys that may run at once across all apps; deploys of the same app always run one at a time
+DEPLOY_WORKERS = int(os.getenv('DEPLOY_WORKERS', '2'))
+# Finished jobs kept around for /jobs and /job
+DEPLOY_HISTORY = int(os.getenv('DEPLOY_HISTORY', '50'))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+
+class DeployError(Exception):
+    pass
+
+
+class DeployJob:
+    def __init__(self, job_id, app_name, repo_url, heroku_api_key, status_message=None):
+        self.id = job_id
+        self.app_name = app_name
+        self.repo_url = repo_url
+        self.heroku_api_key = heroku_api_key
+        self.status_message = status_message
+        self.state = QUEUED
+        self.stage_name = None
+        self.stages = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+        self.build_id = None
+
+    async def stage(self, name, coro):
+        """Run one pipeline stage, recording how long it took."""
+        self.stage_name = name
+        await self.notify()
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self.stages.append((name, time.monotonic() - started))
+            self.stage_name = None
+
+    async def notify(self):
+        if self.status_message is None:
+            return
+        try:
+            await self.status_message.edit_text(self.describe())
+        except Exception:
+            # Progress updates are best effort; the job itself carries on
+            pass
+
+    def summary(self):
+        current = f' ({self.stage_name})' if self.stage_name else ''
+        return f'#{self.id} {self.app_name}: {self.state}{current}'
+
+    def describe(self):
+        lines = [f'Deploy #{self.id} of {self.repo_url} to {self.app_name}', f'State: {self.state}']
+        if self.stage_name:
+            lines.append(f'Stage: {self.stage_name}')
+        if self.build_id:
+            lines.append(f'Build: {self.build_id}')
+        for name, seconds in self.stages:
+            lines.append(f'  {name}: {seconds:.1f}s')
+        if self.started:
+            end = self.finished or time.time()
+            lines.append(f'Waited {self.started - self.created:.1f}s, ran {end - self.started:.1f}s')
+        if self.error:
+            lines.append(f'Error: {self.error}')
+        return '\n'.join(lines)
+
+
+async def run_deploy(job):
+    # Each deploy gets its own scratch directory, so concurrent deploys never share a tarball
+    workdir = tempfile.mkdtemp(prefix='deploy-')
+    tarball = os.path.join(workdir, 'source.tar.gz')
+    api = heroku_api.client
+    key = job.heroku_api_key
+    try:
+        # Fetch into the cached mirror (a full clone only the first time) and pack the tip, no checkout needed
+        version = await job.stage('package', mirrors.cache.archive(job.repo_url, tarball))
+        await job.stage('app', api.ensure_app(key, job.app_name))
+
+        async def upload():
+            source = await api.create_source(key)
+            await api.upload_source(source['put_url'], tarball)
+            return source['get_url']
+
+        source_url = await job.stage('upload', upload())
+
+        async def build():
+            started = await api.create_build(key, job.app_name, source_url, version)
+            job.build_id = started['id']
+            # Each poll refreshes the status message, so the elapsed time keeps moving while Heroku builds
+            finished = await api.wait_for_build(key, job.app_name, started, lambda build: job.notify())
+            if finished['status'] != 'succeeded':
+                raise DeployError(f"Build {finished['id']} {finished['status']}\n"
+                                  f"{await build_output_tail(finished)}".strip())
+
+        await job.stage('build', build())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def build_output_tail(build, lines=20):
+    """The last lines of a build's output, for the failure message."""
+    url = build.get('output_stream_url')
+    if not url:
+        return ''
+    tail = deque(maxlen=lines)
+    try:
+        async with aclosing(heroku_api.client.stream_lines(url)) as stream:
+            async for line in stream:
+                tail.append(line)
+    except Exception:
+        logger.warning('Could not read the output of build %s', build.get('id'))
+    return '\n'.join(tail)
+
+
+class DeployScheduler:
+    def __init__(self, workers=DEPLOY_WORKERS, history=DEPLOY_HISTORY):
+        self._slots = asyncio.Semaphore(workers)
+        self._app_locks = {}
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self.history = history
+
+    def submit(self, app_name, repo_url, heroku_api_key, status_message=None):
+        job = DeployJob(next(self._ids), app_name, repo_url, heroku_api_key, status_message)
+        self._jobs[job.id] = job
+        self._trim()
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet. Returns False if it is unknown or already running."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state != QUEUED:
+            return False
+        job.task.cancel()
+        return True
+
+    def _trim(self):
+        finished = [job.id for job in self._jobs.values() if job.state not in (QUEUED, RUNNING)]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job):
+        # [lock, number of jobs holding or waiting for it]
+        app_lock = self._app_locks.setdefault(job.app_name, [asyncio.Lock(), 0])
+        app_lock[1] += 1
+        try:
+            # Per-app lock first, so a job waiting on its app does not hold a worker slot
+            async with app_lock[0]:
+                async with self._slots:
+                    job.state = RUNNING
+                    job.started = time.time()
+                    await run_deploy(job)
+                    job.state = DONE
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+        except subprocess.CalledProcessError as e:
+            job.state = FAILED
+            job.error = e.stderr.strip() or str(e)
+        except (DeployError, heroku_api.HerokuError) as e:
+            job.state = FAILED
+            job.error = str(e)
+        except Exception as e:
+            logger.exception('Deploy #%d failed', job.id)
+            job.state = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            app_lock[1] -= 1
+            if app_lock[1] == 0:
+                del self._app_locks[job.app_name]
+            await job.notify()
+
+
+scheduler = DeployScheduler()
+
+
+async def list_jobs(client, message):
+    jobs_list = scheduler.list()
+    if not jobs_list:
+        await message.reply('No deploy jobs yet.')
+        return
+    await message.reply('Deploy jobs:\n' + '\n'.join(job.summary() for job in reversed(jobs_list)))
+
+
+async def show_job(client, message):
+    parts = message.text.split(' ', 1)
+    job = scheduler.get(int(parts[1])) if len(parts) > 1 and parts[1].strip().isdigit() else None
+    if job is None:
+        await message.reply('Unknown job. Use /jobs to see job IDs.')
+        return
+    await message.reply(job.describe())
+
+
+async def cancel_job(client, message):
+    parts = message.text.split(' ', 1)
+    if len(parts) < 2 or not parts[1].strip().isdigit():
+        await message.reply('Usage: /cancel <job_id>')
+        return
+    if scheduler.cancel(int(parts[1])):
+        await message.reply(f'Deploy #{int(parts[1])} cancelled.')
+    else:
+        await message.reply('Only queued jobs can be cancelled.')
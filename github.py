@@ -1,8 +1,16 @@
 import os
-import requests
-import base64
+import shutil
 import subprocess
+import tempfile
+import jobs
+import mirrors
+import pager
+import workers
+import github_api
+import repo_index
+from github_api import api
 from pyrogram import Client, filters
+from sessions import user_sessions
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -16,6 +24,13 @@ HEADERS = {
     "Accept": "application/vnd.github.v3+json"
 }
 
+def _headers(message):
+    # Each request uses the sender's own token from /setgithub, falling back to GITHUB_TOKEN
+    token = user_sessions.get(message.from_user.id).get('github_api_key')
+    if not token:
+        return HEADERS
+    return {**HEADERS, "Authorization": f"token {token}"}
+
 async def github_help(client, message):
     await message.reply('/clone <repo_url> - Clone a GitHub repository\n'
                         '/create_repo <repo_name> - Create a new GitHub repository\n'
@@ -26,25 +41,49 @@ async def github_help(client, message):
                         '/edit_file <repo> <path> <content> - Edit a file in a GitHub repository\n'
                         '/add_file <repo> <path> <content> - Add a new file to a GitHub repository\n'
                         '/remove_file <repo> <path> - Remove a file from a GitHub repository\n'
-                        '/list_repos - List all repositories')
+                        '/upload <repo> [path] - Commit a document to the repository (as its caption, or in reply to it)\n'
+                        '/download <repo> <path> [ref] - Get a file from a GitHub repository as a document\n'
+                        '/batch <repo> <commit_message> - Commit many changes at once; one per block:\n'
+                        '    @@ add <path> / @@ edit <path> followed by the content lines, or @@ delete <path>.\n'
+                        '    Documents sent with (or replied to by) the command are added under their caption or file name.\n'
+                        '/list_repos [query] - List all repositories, or those matching a name prefix or close spelling\n'
+                        'Repository arguments may be short names (myrepo) for repositories in your own listing.\n'
+                        '/cache - Show GitHub file and AI response cache statistics')
 
 async def clone_repo(client, message):
     repo_url = message.text.split(' ', 1)[1]
+    repo_name = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
     try:
-        result = subprocess.run(['git', 'clone', repo_url], capture_output=True, text=True)
+        if os.path.isdir(os.path.join(repo_name, '.git')):
+            # Already cloned: bring it up to date instead of failing on the existing directory
+            await jobs.run(['git', 'pull', '--ff-only'], cwd=repo_name, check=True)
+            await message.reply('Repository already cloned; pulled the latest changes.')
+            return
+        if mirrors.cache.complete:
+            # Objects come from the local mirror, so only new history crosses the network
+            async with mirrors.cache.hold(repo_url) as mirror:
+                await jobs.run(['git', 'clone', '--reference', mirror, '--dissociate', repo_url, repo_name],
+                               check=True)
+        else:
+            # A shallow or partial mirror cannot back a --reference clone
+            await jobs.run(['git', 'clone', repo_url, repo_name], check=True)
         await message.reply('Repository cloned successfully.')
+    except subprocess.CalledProcessError as e:
+        await message.reply(f'Error cloning repository: {e.stderr.strip()}')
     except Exception as e:
         await message.reply(f'Error cloning repository: {str(e)}')
 
 async def create_repo(client, message):
+    headers = _headers(message)
     repo_name = message.text.split(' ', 1)[1]
     try:
-        response = requests.post(
-            'https://api.github.com/user/repos',
-            headers=HEADERS,
+        response = await api.post(
+            '/user/repos',
+            headers=headers,
             json={"name": repo_name}
         )
         if response.status_code == 201:
+            repo_index.get(headers).added(response.json())
             await message.reply('Repository created successfully.')
         else:
             await message.reply(f'Error creating repository: {response.json().get("message")}')
@@ -56,79 +95,142 @@ async def commit_changes(client, message):
     repo_path = parts[1]
     commit_message = parts[2]
     try:
-        os.chdir(repo_path)
-        subprocess.run(['git', 'add', '.'])
-        result = subprocess.run(['git', 'commit', '-m', commit_message], capture_output=True, text=True)
-        os.chdir('..')
+        await jobs.run(['git', 'add', '.'], cwd=repo_path, check=True)
+        await jobs.run(['git', 'commit', '-m', commit_message], cwd=repo_path, check=True)
         await message.reply('Changes committed successfully.')
+    except subprocess.CalledProcessError as e:
+        await message.reply(f'Error committing changes: {(e.stdout + e.stderr).strip()}')
     except Exception as e:
         await message.reply(f'Error committing changes: {str(e)}')
 
 async def push_changes(client, message):
     repo_path = message.text.split(' ', 1)[1]
     try:
-        os.chdir(repo_path)
-        result = subprocess.run(['git', 'push'], capture_output=True, text=True)
-        os.chdir('..')
+        await jobs.run(['git', 'push'], cwd=repo_path, check=True)
         await message.reply('Changes pushed to GitHub successfully.')
+    except subprocess.CalledProcessError as e:
+        await message.reply(f'Error pushing changes: {e.stderr.strip()}')
     except Exception as e:
         await message.reply(f'Error pushing changes: {str(e)}')
 
 async def pull_changes(client, message):
     repo_path = message.text.split(' ', 1)[1]
     try:
-        os.chdir(repo_path)
-        result = subprocess.run(['git', 'pull'], capture_output=True, text=True)
-        os.chdir('..')
+        await jobs.run(['git', 'pull'], cwd=repo_path, check=True)
         await message.reply('Changes pulled from GitHub successfully.')
+    except subprocess.CalledProcessError as e:
+        await message.reply(f'Error pulling changes: {e.stderr.strip()}')
     except Exception as e:
         await message.reply(f'Error pulling changes: {str(e)}')
 
 async def view_file(client, message):
+    headers = _headers(message)
     parts = message.text.split(' ', 2)
     repo = parts[1]
     path = parts[2]
 
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
-
     try:
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code == 200:
-            file_content = base64.b64decode(response.json()['content']).decode('utf-8')
-            await message.reply(f"Content of {path}:\n{file_content}")
+        repo = await repo_index.resolve(headers, repo)
+        response, entry = await github_api.get_file(repo, path, headers)
+        if entry is not None and not entry.content:
+            # The contents API leaves out files over 1 MB; fetch those raw instead
+            await _send_raw_file(message, repo, path, headers)
+        elif entry is not None:
+            await pager.send_output(message, f"Content of {path}:", entry.content, os.path.basename(path))
         else:
             await message.reply(f"Error fetching file: {response.json().get('message')}")
     except Exception as e:
         await message.reply(f'Error viewing file: {str(e)}')
 
+async def _send_raw_file(message, repo, path, headers, ref=None):
+    workdir = tempfile.mkdtemp(prefix='download-')
+    dest = os.path.join(workdir, os.path.basename(path) or 'file')
+    try:
+        response = await github_api.download_file(repo, path, dest, headers, ref)
+        if response.status_code != 200:
+            await message.reply(f"Error fetching file: {response.json().get('message')}")
+        elif os.path.getsize(dest) == 0:
+            await message.reply(f"File {path} is empty.")
+        else:
+            # Pyrogram uploads from disk in parts, so the file is never held in memory whole
+            await message.reply_document(dest, caption=f"{path} from {repo}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+async def download_file(client, message):
+    headers = _headers(message)
+    parts = message.text.split(' ', 3)
+    if len(parts) < 3:
+        await message.reply('Usage: /download <repo> <path> [ref]')
+        return
+    repo = parts[1]
+    path = parts[2]
+    ref = parts[3].strip() if len(parts) > 3 else None
+
+    try:
+        repo = await repo_index.resolve(headers, repo)
+        await _send_raw_file(message, repo, path, headers, ref)
+    except Exception as e:
+        await message.reply(f'Error downloading file: {str(e)}')
+
+async def upload_file(client, message):
+    headers = _headers(message)
+    parts = (message.text or message.caption).split(' ', 2)
+    source = message if message.document else message.reply_to_message
+    if len(parts) < 2 or source is None or not source.document:
+        await message.reply('Usage: send a document with the caption /upload <repo> [path], or reply to one with it.')
+        return
+    repo = parts[1]
+    path = parts[2].strip() if len(parts) > 2 else ''
+    if not path or path.endswith('/'):
+        path += source.document.file_name or 'document'
+
+    try:
+        repo = await repo_index.resolve(headers, repo)
+        # Telegram chunks go straight into the blob upload, base64-encoded on the way
+        sha = await github_api.commit_files(repo, {path: client.stream_media(source)},
+                                            f"Upload {path} via Telegram bot", headers)
+        await message.reply(f"Uploaded {path} ({source.document.file_size} bytes) to {repo} in {sha[:7]}.")
+    except Exception as e:
+        await message.reply(f'Error uploading file: {str(e)}')
+
 async def edit_file(client, message):
+    headers = _headers(message)
     parts = message.text.split(' ', 3)
     repo = parts[1]
     path = parts[2]
     content = parts[3]
 
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
-
     try:
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code != 200:
-            await message.reply(f"Error fetching file: {response.json().get('message')}")
-            return
+        repo = await repo_index.resolve(headers, repo)
+        url = f"/repos/{repo}/contents/{path}"
+        data_bytes = content.encode('utf-8')
+        encoded = await workers.run(workers.b64encode, data_bytes, size=len(data_bytes))
+        for attempt in range(2):
+            response, sha = await github_api.get_file_sha(repo, path, headers)
+            if sha is None:
+                await message.reply(f"Error fetching file: {response.json().get('message')}")
+                return
 
-        sha = response.json()['sha']
+            data = {
+                "message": f"Edit {path} via Telegram bot",
+                "committer": {
+                    "name": "Telegram Bot",
+                    "email": "bot@example.com"
+                },
+                "content": encoded,
+                "sha": sha
+            }
 
-        data = {
-            "message": f"Edit {path} via Telegram bot",
-            "committer": {
-                "name": "Telegram Bot",
-                "email": "bot@example.com"
-            },
-            "content": base64.b64encode(content.encode('utf-8')).decode('utf-8'),
-            "sha": sha
-        }
+            response = await api.put(url, json=data, headers=headers)
+            # A cached sha can go stale when the file changes elsewhere; refetch it once
+            if response.status_code in (409, 422) and attempt == 0:
+                github_api.file_removed(repo, path)
+                continue
+            break
 
-        response = requests.put(url, json=data, headers=HEADERS)
         if response.status_code == 200:
+            github_api.file_written(repo, path, data_bytes, response)
             await message.reply(f"File {path} edited successfully.")
         else:
             await message.reply(f"Error editing file: {response.json().get('message')}")
@@ -136,25 +238,29 @@ async def edit_file(client, message):
         await message.reply(f'Error editing file: {str(e)}')
 
 async def add_file(client, message):
+    headers = _headers(message)
     parts = message.text.split(' ', 3)
     repo = parts[1]
     path = parts[2]
     content = parts[3]
 
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
-
     try:
+        repo = await repo_index.resolve(headers, repo)
+        url = f"/repos/{repo}/contents/{path}"
+        data_bytes = content.encode('utf-8')
+        encoded = await workers.run(workers.b64encode, data_bytes, size=len(data_bytes))
         data = {
             "message": f"Add {path} via Telegram bot",
             "committer": {
                 "name": "Telegram Bot",
                 "email": "bot@example.com"
             },
-            "content": base64.b64encode(content.encode('utf-8')).decode('utf-8')
+            "content": encoded
         }
 
-        response = requests.put(url, json=data, headers=HEADERS)
+        response = await api.put(url, json=data, headers=headers)
         if response.status_code == 201:
+            github_api.file_written(repo, path, data_bytes, response)
             await message.reply(f"File {path} added successfully.")
         else:
             await message.reply(f"Error adding file: {response.json().get('message')}")
@@ -162,46 +268,121 @@ async def add_file(client, message):
         await message.reply(f'Error adding file: {str(e)}')
 
 async def remove_file(client, message):
+    headers = _headers(message)
     parts = message.text.split(' ', 2)
     repo = parts[1]
     path = parts[2]
 
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
-
     try:
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code != 200:
-            await message.reply(f"Error fetching file: {response.json().get('message')}")
-            return
+        repo = await repo_index.resolve(headers, repo)
+        url = f"/repos/{repo}/contents/{path}"
+        for attempt in range(2):
+            response, sha = await github_api.get_file_sha(repo, path, headers)
+            if sha is None:
+                await message.reply(f"Error fetching file: {response.json().get('message')}")
+                return
 
-        sha = response.json()['sha']
+            data = {
+                "message": f"Remove {path} via Telegram bot",
+                "committer": {
+                    "name": "Telegram Bot",
+                    "email": "bot@example.com"
+                },
+                "sha": sha
+            }
 
-        data = {
-            "message": f"Remove {path} via Telegram bot",
-            "committer": {
-                "name": "Telegram Bot",
-                "email": "bot@example.com"
-            },
-            "sha": sha
-        }
+            response = await api.delete(url, json=data, headers=headers)
+            if response.status_code in (409, 422) and attempt == 0:
+                github_api.file_removed(repo, path)
+                continue
+            break
 
-        response = requests.delete(url, json=data, headers=HEADERS)
         if response.status_code == 200:
+            github_api.file_removed(repo, path)
             await message.reply(f"File {path} removed successfully.")
         else:
             await message.reply(f"Error removing file: {response.json().get('message')}")
     except Exception as e:
         await message.reply(f'Error removing file: {str(e)}')
 
+def _parse_batch(text):
+    lines = text.split('\n')
+    header = lines[0].split(' ', 2)
+    repo = header[1]
+    commit_message = header[2] if len(header) > 2 else 'Batch update via Telegram bot'
+
+    changes = {}
+    path = None
+    for line in lines[1:]:
+        if line.startswith('@@ '):
+            action, path = line[3:].strip().split(' ', 1)
+            path = path.strip()
+            if action == 'delete':
+                changes[path] = None
+                path = None
+            elif action in ('add', 'edit'):
+                changes[path] = []
+            else:
+                raise ValueError(f'Unknown batch action: {action}')
+        elif path is not None:
+            changes[path].append(line)
+    for path, content in changes.items():
+        if content is not None:
+            changes[path] = '\n'.join(content).encode('utf-8')
+    return repo, commit_message, changes
+
+async def _batch_documents(client, message):
+    source = message
+    if not (message.document or message.media_group_id) and message.reply_to_message:
+        source = message.reply_to_message
+    if source.media_group_id:
+        group = await client.get_media_group(source.chat.id, source.id)
+    else:
+        group = [source]
+    documents = [m for m in group if m.document]
+
+    def repo_path(m):
+        caption = (m.caption or '').strip()
+        return caption if caption and not caption.startswith('/') and '\n' not in caption else m.document.file_name
+
+    # Streamed into the blob uploads as they are read, rather than downloaded into memory first
+    return {repo_path(m): client.stream_media(m) for m in documents}
+
+async def batch_commit(client, message):
+    headers = _headers(message)
+    try:
+        repo, commit_message, changes = _parse_batch(message.text or message.caption)
+        repo = await repo_index.resolve(headers, repo)
+        changes.update(await _batch_documents(client, message))
+        if not changes:
+            await message.reply('Nothing to commit. Use /github_help to see the /batch format.')
+            return
+
+        sha = await github_api.commit_files(repo, changes, commit_message, headers)
+        await message.reply(f"Committed {len(changes)} change(s) to {repo} in {sha[:7]}.")
+    except Exception as e:
+        await message.reply(f'Error committing batch: {str(e)}')
+
 async def list_repos(client, message):
-    url = "https://api.github.com/user/repos"
+    headers = _headers(message)
+    parts = message.text.split(' ', 1)
+    query = parts[1].strip() if len(parts) > 1 else ''
     try:
-        response = requests.get(url, headers=HEADERS)
-        if response.status_code == 200:
-            repos = response.json()
-            repo_list = "\n".join([repo['full_name'] for repo in repos])
-            await message.reply(f"Your repositories:\n{repo_list}")
+        # Served from the in-memory index; refreshing it is usually a single 304
+        index = repo_index.get(headers)
+        await index.ensure(fresh=True)
+        if query:
+            repos = index.search(query)
+            title = f"Repositories matching '{query}':" if repos else f"No repositories match '{query}'."
         else:
-            await message.reply(f"Error fetching repositories: {response.json().get('message')}")
+            repos = index.names()
+            title = f"Your repositories ({len(repos)}):"
+        await pager.send_output(message, title, "\n".join(repos), 'repositories.txt')
     except Exception as e:
         await message.reply(f'Error listing repositories: {str(e)}')
+
+def cache_stats():
+    stats = github_api.contents.stats()
+    return ('GitHub file cache:\n'
+            f"hits: {stats['hits']}, misses: {stats['misses']}\n"
+            f"entries: {stats['entries']}, size: {stats['bytes'] / 1024:.1f} KiB")
@@ -0,0 +1,426 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from collections import OrderedDict
+import aiohttp
+import metrics
+import workers
+from api_client import PooledClient
+
+# Point this at a local stub server to exercise the bot without touching GitHub
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+# Upper bound on concurrent requests (and pooled keep-alive connections)
+GITHUB_MAX_IN_FLIGHT = int(os.getenv('GITHUB_MAX_IN_FLIGHT', '8'))
+# Requests kept in reserve; once the budget drops to this, calls queue until the window resets
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv('GITHUB_RATE_LIMIT_RESERVE', '10'))
+# Longest time (seconds) a call will queue for the budget before giving up
+GITHUB_MAX_RATE_WAIT = float(os.getenv('GITHUB_MAX_RATE_WAIT', '60'))
+# Bounds for the file contents cache
+CONTENT_CACHE_ENTRIES = int(os.getenv('CONTENT_CACHE_ENTRIES', '256'))
+CONTENT_CACHE_BYTES = int(os.getenv('CONTENT_CACHE_BYTES', str(16 * 1024 * 1024)))
+# Longest pause (seconds) in a streamed upload or download; the transfer as a whole has no time limit
+TRANSFER_IDLE_TIMEOUT = float(os.getenv('TRANSFER_IDLE_TIMEOUT', '60'))
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class GitHubError(Exception):
+    pass
+
+
+class Response:
+    """The parts of a finished response the handlers need, mirroring requests.Response."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        if not self.content:
+            return {}
+        return json.loads(self.content)
+
+
+class RateBudget:
+    """What GitHub last told us about one token's budget for one resource."""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+
+    def update(self, headers):
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        self.limit = int(headers.get('X-RateLimit-Limit', 0))
+        self.remaining = int(headers['X-RateLimit-Remaining'])
+        self.reset_at = float(headers.get('X-RateLimit-Reset', 0))
+
+
+class GitHubClient(PooledClient):
+    def __init__(self, base_url=GITHUB_API_URL, max_in_flight=GITHUB_MAX_IN_FLIGHT,
+                 reserve=GITHUB_RATE_LIMIT_RESERVE, max_rate_wait=GITHUB_MAX_RATE_WAIT):
+        super().__init__(base_url, max_in_flight, aiohttp.ClientTimeout(total=60))
+        self.reserve = reserve
+        self.max_rate_wait = max_rate_wait
+        self._budgets = {}
+
+    def budget(self, token, resource='core'):
+        return self._budgets.setdefault((token, resource), RateBudget())
+
+    async def _acquire_budget(self, budget):
+        # Queue while the budget is (nearly) spent and the window has not reset yet
+        while budget.remaining is not None and budget.remaining <= self.reserve:
+            wait = budget.reset_at - time.time()
+            if wait <= 0:
+                budget.remaining = None
+                break
+            if wait > self.max_rate_wait:
+                raise RateLimitError(
+                    f'GitHub rate limit nearly exhausted; resets in {int(wait)} seconds.')
+            await asyncio.sleep(wait + 0.5)
+        if budget.remaining is not None:
+            # Claim one request up front so concurrent callers see an accurate budget
+            budget.remaining -= 1
+
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, headers=None, json=None, params=None, data=None, retries=2, timeout=None):
+        headers = dict(headers or {})
+        url = self.url(path)
+        resource = 'search' if '/search/' in url else 'core'
+        budget = self.budget(headers.get('Authorization'), resource)
+
+        # Streamed transfers pass their own timeout; everything else keeps the session's
+        options = {'timeout': timeout} if timeout is not None else {}
+
+        for attempt in range(retries + 1):
+            await self._acquire_budget(budget)
+            async with self._slots:
+                with metrics.timed('github', method):
+                    async with self._get_session().request(
+                        method, url, headers=headers, json=json, params=params, data=data, **options
+                    ) as resp:
+                        content = await resp.read()
+                        response = Response(resp.status, resp.headers, content)
+            budget.update(response.headers)
+
+            # Primary or secondary rate limit hit: back off and retry instead of failing
+            limited = response.status_code == 429 or (
+                response.status_code == 403 and
+                (response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers)
+            )
+            if not limited or attempt == retries:
+                return response
+            if 'Retry-After' in response.headers:
+                wait = float(response.headers['Retry-After'])
+            else:
+                wait = budget.reset_at - time.time()
+            if wait > self.max_rate_wait:
+                return response
+            await asyncio.sleep(max(wait, 1))
+        return response
+
+    async def download(self, path, dest, headers=None, params=None, chunk_size=64 * 1024):
+        """GET `path` straight into the file `dest`, a chunk at a time.
+
+        Returns the Response; its content is only read (for the error message) when the status is not 200.
+        """
+        headers = dict(headers or {})
+        budget = self.budget(headers.get('Authorization'))
+        await self._acquire_budget(budget)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=TRANSFER_IDLE_TIMEOUT)
+        async with self._slots:
+            with metrics.timed('github', 'download'):
+                async with self._get_session().get(self.url(path), headers=headers, params=params,
+                                                   timeout=timeout) as resp:
+                    content = b''
+                    if resp.status == 200:
+                        with open(dest, 'wb') as f:
+                            async for chunk in resp.content.iter_chunked(chunk_size):
+                                f.write(chunk)
+                    else:
+                        content = await resp.read()
+                    response = Response(resp.status, resp.headers, content)
+        budget.update(response.headers)
+        return response
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+    async def patch(self, path, **kwargs):
+        return await self.request('PATCH', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request('DELETE', path, **kwargs)
+
+
+class CachedFile:
+    def __init__(self, content, sha, etag=None):
+        self.content = content
+        self.sha = sha
+        self.etag = etag
+
+
+class ContentCache:
+    """LRU of decoded file contents keyed by (repo, path, ref), bounded by entry count and bytes."""
+
+    def __init__(self, max_entries=CONTENT_CACHE_ENTRIES, max_bytes=CONTENT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.discard(key)
+        if len(entry.content) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += len(entry.content)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= len(old.content)
+
+    def discard(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.content)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+
+# Shared client: one connection pool and one rate-limit ledger for the whole bot
+api = GitHubClient()
+contents = ContentCache()
+
+
+def _contents_path(repo, path):
+    return f"/repos/{repo}/contents/{path}"
+
+
+async def get_file(repo, path, headers, ref=None):
+    """Fetch a file through the cache, revalidating with If-None-Match.
+
+    Returns (response, entry); entry is None when the request failed. A 304
+    costs no rate limit and reuses the cached decoded content.
+    """
+    key = (repo, path, ref)
+    entry = contents.get(key)
+    headers = dict(headers)
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    params = {'ref': ref} if ref else None
+
+    response = await api.get(_contents_path(repo, path), headers=headers, params=params)
+    if response.status_code == 304 and entry is not None:
+        contents.hits += 1
+        return response, entry
+    if response.status_code != 200:
+        if response.status_code == 404:
+            contents.discard(key)
+        return response, None
+
+    contents.misses += 1
+    content, sha = await workers.run(workers.decode_contents, response.content, size=len(response.content))
+    entry = CachedFile(content, sha, response.headers.get('ETag'))
+    contents.put(key, entry)
+    return response, entry
+
+
+async def get_file_sha(repo, path, headers, ref=None):
+    """Blob sha needed to update or delete a file; served from the cache without a request when known."""
+    entry = contents.get((repo, path, ref))
+    if entry is not None:
+        contents.hits += 1
+        return None, entry.sha
+    response, entry = await get_file(repo, path, headers, ref)
+    return response, entry.sha if entry is not None else None
+
+
+async def download_file(repo, path, dest, headers, ref=None):
+    """Stream a file's raw bytes into `dest`; unlike the JSON contents API this works up to 100 MB."""
+    params = {'ref': ref} if ref else None
+    return await api.download(_contents_path(repo, path), dest, params=params,
+                              headers={**headers, 'Accept': 'application/vnd.github.raw'})
+
+
+def file_written(repo, path, content, response, ref=None):
+    """Record the bot's own write so the next read or edit needs no extra round trip."""
+    sha = response.json().get('content', {}).get('sha')
+    if sha:
+        contents.put((repo, path, ref), CachedFile(content, sha))
+    else:
+        contents.discard((repo, path, ref))
+
+
+def file_removed(repo, path, ref=None):
+    contents.discard((repo, path, ref))
+
+
+COMMITTER = {
+    "name": "Telegram Bot",
+    "email": "bot@example.com"
+}
+
+
+def _check(response, *expected):
+    if response.status_code not in expected:
+        try:
+            message = response.json().get('message')
+        except ValueError:
+            # Proxies and size limits can answer with plain text or HTML
+            message = None
+        raise GitHubError(message or f'HTTP {response.status_code}')
+    return response.json()
+
+
+async def _blob_body(chunks):
+    """JSON body of a base64 blob, encoded chunk by chunk so the file is never held in memory whole."""
+    yield b'{"encoding": "base64", "content": "'
+    rest = b''
+    async for chunk in chunks:
+        chunk = rest + chunk
+        # Encode whole 3-byte groups only, so no padding lands in the middle of the stream
+        cut = len(chunk) - len(chunk) % 3
+        rest = chunk[cut:]
+        yield base64.b64encode(chunk[:cut])
+    yield base64.b64encode(rest) + b'"}'
+
+
+async def create_blob(repo, content, headers):
+    """Upload one blob. `content` is bytes, or an async iterable of byte chunks to stream."""
+    if not isinstance(content, bytes):
+        # A streamed body cannot be replayed, so no retries; chunked transfer keeps memory flat
+        response = await api.request(
+            'POST', f"/repos/{repo}/git/blobs",
+            headers={**headers, 'Content-Type': 'application/json'},
+            data=_blob_body(content), retries=0,
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=TRANSFER_IDLE_TIMEOUT),
+        )
+        return _check(response, 201)['sha']
+    encoded = await workers.run(workers.b64encode, content, size=len(content))
+    response = await api.post(
+        f"/repos/{repo}/git/blobs",
+        headers=headers,
+        json={"content": encoded, "encoding": "base64"}
+    )
+    return _check(response, 201)['sha']
+
+
+async def _branch_head(repo, branch, headers):
+    if branch is None:
+        branch = _check(await api.get(f"/repos/{repo}", headers=headers), 200)['default_branch']
+    ref = _check(await api.get(f"/repos/{repo}/git/ref/heads/{branch}", headers=headers), 200)
+    head = ref['object']['sha']
+    commit = _check(await api.get(f"/repos/{repo}/git/commits/{head}", headers=headers), 200)
+    return branch, head, commit['tree']['sha']
+
+
+async def _tree_modes(repo, tree_sha, paths, headers):
+    """Modes of the `paths` that already exist as files in the tree, reading only the directories involved."""
+    listings = {}
+
+    async def listing(directory):
+        if directory not in listings:
+            sha = tree_sha
+            if directory:
+                parent, _, name = directory.rpartition('/')
+                entry = (await listing(parent)).get(name)
+                sha = entry['sha'] if entry and entry['type'] == 'tree' else None
+            entries = {}
+            if sha is not None:
+                response = await api.get(f"/repos/{repo}/git/trees/{sha}", headers=headers)
+                entries = {entry['path']: entry for entry in _check(response, 200)['tree']}
+            listings[directory] = entries
+        return listings[directory]
+
+    modes = {}
+    for path in paths:
+        parent, _, name = path.rpartition('/')
+        entry = (await listing(parent)).get(name)
+        if entry and entry['type'] == 'blob':
+            modes[path] = entry['mode']
+    return modes
+
+
+async def commit_files(repo, changes, message, headers, branch=None):
+    """Apply many adds/edits/deletes as a single commit through the Git Data API.
+
+    `changes` maps path -> bytes or an async iterable of byte chunks (add or
+    replace), or None (delete). Blobs are
+    created concurrently with the branch lookup, then one tree, one commit and
+    one ref update follow. Edited files keep their mode (executable, symlink);
+    new ones are 100644. Returns the new commit sha.
+    """
+    paths = list(changes)
+    uploads = [path for path in paths if changes[path] is not None]
+
+    async def base():
+        branch_name, head, base_tree = await _branch_head(repo, branch, headers)
+        return branch_name, head, base_tree, await _tree_modes(repo, base_tree, paths, headers)
+
+    results = await asyncio.gather(base(), *[create_blob(repo, changes[path], headers) for path in uploads])
+    (branch_name, head, base_tree, modes), blob_shas = results[0], dict(zip(uploads, results[1:]))
+
+    tree = [
+        {"path": path, "mode": modes.get(path, "100644"), "type": "blob", "sha": blob_shas.get(path)}
+        for path in paths
+    ]
+    response = await api.post(f"/repos/{repo}/git/trees", headers=headers,
+                              json={"base_tree": base_tree, "tree": tree})
+    tree_sha = _check(response, 201)['sha']
+
+    response = await api.post(f"/repos/{repo}/git/commits", headers=headers, json={
+        "message": message,
+        "tree": tree_sha,
+        "parents": [head],
+        "committer": COMMITTER
+    })
+    commit_sha = _check(response, 201)['sha']
+
+    response = await api.patch(f"/repos/{repo}/git/refs/heads/{branch_name}", headers=headers,
+                               json={"sha": commit_sha})
+    _check(response, 200)
+
+    # Keep the contents cache coherent with what we just wrote
+    for path in paths:
+        if branch is not None:
+            # The branch may also be the default one that (repo, path, None) refers to
+            contents.discard((repo, path, None))
+        if path in blob_shas and isinstance(changes[path], bytes):
+            contents.put((repo, path, branch), CachedFile(changes[path], blob_shas[path]))
+        else:
+            contents.discard((repo, path, branch))
+    return commit_sha
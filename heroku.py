@@ -0,0 +1,69 @@
+import deploys
+import heroku_api
+import log_tail
+import pager
+from sessions import user_sessions
+
+NOT_CONFIGURED = 'Please set your Heroku API key and app name first using /setheroku and /setappname commands.'
+
+
+def _settings(message):
+    """The sender's (app_name, heroku_api_key), or (None, None) if either is missing."""
+    session = user_sessions.get(message.from_user.id)
+    app_name = session.get('app_name')
+    heroku_api_key = session.get('heroku_api_key')
+    if not app_name or not heroku_api_key:
+        return None, None
+    return app_name, heroku_api_key
+
+
+def render_dynos(dynos):
+    """Dynos grouped by process type, laid out like `heroku ps`."""
+    if not dynos:
+        return 'No dynos are running.'
+    groups = {}
+    for dyno in sorted(dynos, key=lambda dyno: dyno['name']):
+        groups.setdefault(dyno['type'], []).append(dyno)
+    lines = []
+    for dyno_type, group in groups.items():
+        lines.append(f"=== {dyno_type} ({group[0]['size']}): {group[0]['command']} ({len(group)})")
+        lines += [f"{dyno['name']}: {dyno['state']} {dyno['updated_at']}" for dyno in group]
+        lines.append('')
+    return '\n'.join(lines).strip()
+
+
+async def deploy(client, message):
+    repo_url = message.text.split(' ', 1)[1]  # Example: "https://github.com/user/repo"
+    app_name, heroku_api_key = _settings(message)
+    if not app_name:
+        await message.reply(NOT_CONFIGURED)
+        return
+
+    status_message = await message.reply('Deployment queued.')
+    job = deploys.scheduler.submit(app_name, repo_url, heroku_api_key, status_message)
+    await job.notify()
+
+
+async def check_status(client, message):
+    app_name, heroku_api_key = _settings(message)
+    if not app_name:
+        await message.reply(NOT_CONFIGURED)
+        return
+
+    try:
+        dynos = await heroku_api.client.dynos(heroku_api_key, app_name)
+        await pager.send_output(message, f'Status of {app_name}:', render_dynos(dynos), f'{app_name}-status.txt')
+    except Exception as e:
+        await message.reply(f'Error checking status: {str(e)}')
+
+
+async def get_logs(client, message):
+    app_name, heroku_api_key = _settings(message)
+    if not app_name:
+        await message.reply(NOT_CONFIGURED)
+        return
+
+    try:
+        await log_tail.logs_command(client, message, app_name, heroku_api_key)
+    except Exception as e:
+        await message.reply(f'Error retrieving logs: {str(e)}')
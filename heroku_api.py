@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+import aiohttp
+import metrics
+from api_client import PooledClient
+
+# The bench points this at its Heroku stub
+HEROKU_API_URL = os.getenv('HEROKU_API_URL', 'https://api.heroku.com').rstrip('/')
+# Concurrent Heroku API calls
+HEROKU_MAX_IN_FLIGHT = int(os.getenv('HEROKU_MAX_IN_FLIGHT', '8'))
+# Seconds app, formation and dyno state is answered from memory
+HEROKU_CACHE_TTL = float(os.getenv('HEROKU_CACHE_TTL', '5'))
+# Seconds between build status checks, and the longest a build may take
+HEROKU_BUILD_POLL = float(os.getenv('HEROKU_BUILD_POLL', '3'))
+HEROKU_BUILD_TIMEOUT = float(os.getenv('HEROKU_BUILD_TIMEOUT', '1800'))
+
+
+class HerokuError(Exception):
+    def __init__(self, status, error_id, message):
+        super().__init__(message)
+        self.status = status
+        self.id = error_id
+
+
+class HerokuClient(PooledClient):
+    """Pooled client for the Heroku Platform API; every call takes the user's API key."""
+
+    def __init__(self, base_url=HEROKU_API_URL, max_in_flight=HEROKU_MAX_IN_FLIGHT, cache_ttl=HEROKU_CACHE_TTL):
+        # No total timeout: log and build streams stay open as long as the caller reads them
+        super().__init__(base_url, max_in_flight, aiohttp.ClientTimeout(total=None, sock_connect=30))
+        self.cache_ttl = cache_ttl
+        # (api_key, path) -> (expires, body)
+        self._cache = {}
+
+    async def request(self, method, path, api_key, json=None, headers=None):
+        headers = {
+            'Accept': 'application/vnd.heroku+json; version=3',
+            'Authorization': f'Bearer {api_key}',
+            **(headers or {}),
+        }
+        async with self._slots:
+            with metrics.timed('heroku', method):
+                async with self._get_session().request(method, f'{self.base_url}{path}', headers=headers,
+                                                       json=json, timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                    try:
+                        body = await resp.json(content_type=None) if resp.status != 204 else None
+                    except ValueError:
+                        # Heroku's router answers some failures (502, 503) with an HTML page
+                        body = None
+        if resp.status >= 400:
+            body = body if isinstance(body, dict) else {}
+            raise HerokuError(resp.status, body.get('id'), body.get('message') or f'Heroku API returned {resp.status}')
+        return body
+
+    async def cached(self, path, api_key):
+        key = (api_key, path)
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1]
+        body = await self.request('GET', path, api_key)
+        self._cache[key] = (time.monotonic() + self.cache_ttl, body)
+        if len(self._cache) > 1000:
+            now = time.monotonic()
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        return body
+
+    def invalidate(self, api_key, app_name):
+        prefix = f'/apps/{app_name}'
+        for key in [key for key in self._cache if key[0] == api_key and key[1].startswith(prefix)]:
+            del self._cache[key]
+
+    # Apps and dynos
+
+    async def app(self, api_key, app_name):
+        return await self.cached(f'/apps/{app_name}', api_key)
+
+    async def create_app(self, api_key, app_name):
+        body = await self.request('POST', '/apps', api_key, json={'name': app_name})
+        self.invalidate(api_key, app_name)
+        return body
+
+    async def ensure_app(self, api_key, app_name):
+        """Return the app, creating it first if this account does not have it."""
+        try:
+            return await self.app(api_key, app_name)
+        except HerokuError as e:
+            if e.status != 404:
+                raise
+        return await self.create_app(api_key, app_name)
+
+    async def dynos(self, api_key, app_name):
+        return await self.cached(f'/apps/{app_name}/dynos', api_key)
+
+    async def formation(self, api_key, app_name):
+        return await self.cached(f'/apps/{app_name}/formation', api_key)
+
+    async def releases(self, api_key, app_name, limit=10):
+        # Newest first; the Range header keeps the response to `limit` entries
+        return await self.request('GET', f'/apps/{app_name}/releases', api_key,
+                                  headers={'Range': f'version ..; order=desc, max={limit}'})
+
+    # Builds
+
+    async def create_source(self, api_key):
+        """A pre-signed upload slot for a source tarball: {'get_url': ..., 'put_url': ...}."""
+        body = await self.request('POST', '/sources', api_key)
+        return body['source_blob']
+
+    async def upload_source(self, put_url, path):
+        # The URL is pre-signed for an empty Content-Type; the file is streamed, not read into memory
+        with open(path, 'rb') as f, metrics.timed('heroku', 'upload'):
+            async with self._get_session().put(put_url, data=f, headers={'Content-Type': ''}) as resp:
+                if resp.status >= 300:
+                    raise HerokuError(resp.status, None, f'Source upload failed with HTTP {resp.status}')
+
+    async def create_build(self, api_key, app_name, source_url, version=None):
+        body = await self.request('POST', f'/apps/{app_name}/builds', api_key,
+                                  json={'source_blob': {'url': source_url, 'version': version}})
+        self.invalidate(api_key, app_name)
+        return body
+
+    async def build(self, api_key, app_name, build_id):
+        return await self.request('GET', f'/apps/{app_name}/builds/{build_id}', api_key)
+
+    async def wait_for_build(self, api_key, app_name, build, progress=None,
+                             interval=HEROKU_BUILD_POLL, timeout=HEROKU_BUILD_TIMEOUT):
+        """Poll until the build leaves 'pending'; `progress(build)` is awaited after every check."""
+        deadline = time.monotonic() + timeout
+        while build['status'] == 'pending':
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Build {build["id"]} still pending after {timeout:g} seconds')
+            await asyncio.sleep(interval)
+            build = await self.build(api_key, app_name, build['id'])
+            if progress is not None:
+                await progress(build)
+        self.invalidate(api_key, app_name)
+        return build
+
+    # Logs
+
+    async def log_session(self, api_key, app_name, lines=None, tail=False, dyno=None, source=None):
+        """Create a log session and return its Logplex URL, which streams the lines."""
+        options = {'tail': tail}
+        if lines is not None:
+            options['lines'] = lines
+        if dyno:
+            options['dyno'] = dyno
+        if source:
+            options['source'] = source
+        body = await self.request('POST', f'/apps/{app_name}/log-sessions', api_key, json=options)
+        return body['logplex_url']
+
+    async def stream_lines(self, url):
+        """Lines of a log or build output stream, as they arrive. Close the generator to hang up."""
+        async with self._get_session().get(url) as resp:
+            if resp.status >= 400:
+                raise HerokuError(resp.status, None, f'Stream returned HTTP {resp.status}')
+            async for line in resp.content:
+                yield line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+client = HerokuClient()
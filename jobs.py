@@ -0,0 +1,71 @@
+import asyncio
+import os
+import signal
+import subprocess
+import metrics
+
+# Upper bound on how many git/shell processes may run at the same time
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '4'))
+# Default wall-clock limit (seconds) for a single process
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', '600'))
+
+_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+
+
+def _kill(proc):
+    # Processes run in their own session so the whole group (e.g. a shell and its children) goes down together
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run(args, cwd=None, env=None, input=None, timeout=JOB_TIMEOUT, shell=False, check=False):
+    """Async counterpart of subprocess.run(..., capture_output=True, text=True).
+
+    Waits for a free job slot, runs the process in `cwd` without touching the
+    process-wide working directory and returns a subprocess.CompletedProcess.
+    Raises subprocess.TimeoutExpired on timeout and subprocess.CalledProcessError
+    when `check` is set and the process fails. Cancelling the awaiting task kills
+    the process.
+    """
+    async with _slots:
+        kwargs = dict(
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        if shell:
+            proc = await asyncio.create_subprocess_shell(args, **kwargs)
+        else:
+            proc = await asyncio.create_subprocess_exec(*args, **kwargs)
+
+        data = input.encode('utf-8') if isinstance(input, str) else input
+        # Named after the program (git, ...) and its subcommand
+        name = 'shell' if shell else os.path.basename(args[0])
+        operation = args[1] if not shell and len(args) > 1 else ''
+        try:
+            with metrics.timed(name, operation):
+                stdout, stderr = await asyncio.wait_for(proc.communicate(data), timeout)
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            raise subprocess.TimeoutExpired(args, timeout)
+        except asyncio.CancelledError:
+            _kill(proc)
+            await asyncio.shield(proc.wait())
+            raise
+
+    result = subprocess.CompletedProcess(
+        args,
+        proc.returncode,
+        stdout.decode('utf-8', errors='replace'),
+        stderr.decode('utf-8', errors='replace'),
+    )
+    if check:
+        result.check_returncode()
+    return result
+
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import re
+import shlex
+import time
+from collections import deque
+from contextlib import aclosing
+import heroku_api
+import pager
+
+# Lines kept in the ring buffer of a live tail
+LOG_BUFFER_LINES = int(os.getenv('LOG_BUFFER_LINES', '200'))
+# Default and maximum duration (seconds) of a live tail
+LOG_TAIL_SECONDS = float(os.getenv('LOG_TAIL_SECONDS', '300'))
+LOG_TAIL_MAX_SECONDS = float(os.getenv('LOG_TAIL_MAX_SECONDS', '3600'))
+# Minimum seconds between edits of the live log message
+LOG_EDIT_INTERVAL = float(os.getenv('LOG_EDIT_INTERVAL', '2.0'))
+# Lines returned by the one-shot mode when -n is not given
+LOG_DEFAULT_LINES = 100
+# Recent lines replayed for context when a live tail starts; they do not count towards --lines
+LOG_TAIL_BACKLOG = int(os.getenv('LOG_TAIL_BACKLOG', '10'))
+
+USAGE = ('/logs [-n N] [--dyno NAME] [--source app|heroku] [--grep REGEX] - Show the last N log lines\n'
+         '/logs tail [--for SECONDS] [--lines N] [--dyno NAME] [--source app|heroku] [--grep REGEX] - Follow the logs live\n'
+         '/logs stop - Stop following the logs')
+
+# Live tails by chat id
+_tails = {}
+
+
+def parse_options(text):
+    args = shlex.split(text)[1:]
+    options = {'mode': 'once', 'lines': None, 'seconds': LOG_TAIL_SECONDS,
+               'dyno': None, 'source': None, 'pattern': None}
+    if args and args[0] in ('tail', 'stop', 'help'):
+        options['mode'] = args.pop(0)
+    while args:
+        flag = args.pop(0)
+        if not args:
+            raise ValueError(f'Missing value for {flag}')
+        value = args.pop(0)
+        if flag in ('-n', '--lines'):
+            options['lines'] = int(value)
+        elif flag == '--for':
+            options['seconds'] = min(float(value), LOG_TAIL_MAX_SECONDS)
+        elif flag == '--dyno':
+            options['dyno'] = value
+        elif flag == '--source':
+            options['source'] = value
+        elif flag == '--grep':
+            options['pattern'] = re.compile(value)
+        else:
+            raise ValueError(f'Unknown option {flag}')
+    return options
+
+
+def open_session(heroku_api_key, app_name, options, tail=False):
+    """Create a Heroku log session for these options; returns the coroutine for its stream URL.
+
+    A tail replays only LOG_TAIL_BACKLOG old lines; its --lines limit applies to what arrives live.
+    """
+    # Dyno and source filtering happen on Heroku's side; the regex is applied here
+    return heroku_api.client.log_session(
+        heroku_api_key, app_name,
+        lines=LOG_TAIL_BACKLOG if tail else options['lines'] or LOG_DEFAULT_LINES,
+        tail=tail, dyno=options['dyno'], source=options['source'],
+    )
+
+
+def render(header, lines):
+    """Header plus as many of the newest lines as fit in one message."""
+    body = []
+    size = len(header) + 1
+    for line in reversed(lines):
+        size += len(line) + 1
+        if size > pager.TELEGRAM_LIMIT:
+            break
+        body.append(line)
+    return header + '\n' + '\n'.join(reversed(body))
+
+
+class LogTail:
+    def __init__(self, app_name, options, status_message):
+        self.app_name = app_name
+        self.options = options
+        self.status_message = status_message
+        self.buffer = deque(maxlen=LOG_BUFFER_LINES)
+        self.received = 0
+        self.matched = 0
+        self.live = 0
+        self.state = 'live'
+        self._shown = None
+        self._next_edit = 0.0
+
+    def header(self):
+        return (f'Logs of {self.app_name} ({self.state}, {self.matched} lines'
+                f"{f' of {self.received} matched' if self.options['pattern'] else ''}):")
+
+    async def flush(self, final=False):
+        text = render(self.header(), self.buffer)
+        if text == self._shown:
+            return
+        wait = await pager.send_or_defer(lambda: self.status_message.edit_text(text), final)
+        if wait:
+            self._next_edit = time.monotonic() + wait
+            return
+        self._shown = text
+        self._next_edit = time.monotonic() + LOG_EDIT_INTERVAL
+
+    async def _follow(self, heroku_api_key):
+        url = await open_session(heroku_api_key, self.app_name, self.options, tail=True)
+        # aclosing() hangs up the stream as soon as we stop reading, not when the generator is collected
+        async with aclosing(heroku_api.client.stream_lines(url)) as lines:
+            async for line in lines:
+                self.received += 1
+                if self.options['pattern'] and not self.options['pattern'].search(line):
+                    continue
+                self.buffer.append(line)
+                self.matched += 1
+                # The backlog comes first, so everything after it is live
+                if self.received > LOG_TAIL_BACKLOG:
+                    self.live += 1
+                if self.options['lines'] and self.live >= self.options['lines']:
+                    self.state = 'line limit reached'
+                    return
+                if time.monotonic() >= self._next_edit:
+                    await self.flush()
+        self.state = 'stream ended'
+
+    async def run(self, heroku_api_key):
+        try:
+            await asyncio.wait_for(self._follow(heroku_api_key), self.options['seconds'])
+        except asyncio.TimeoutError:
+            self.state = 'time limit reached'
+        except asyncio.CancelledError:
+            self.state = 'stopped'
+        finally:
+            await self.flush(final=True)
+
+
+async def fetch_lines(heroku_api_key, app_name, options):
+    url = await open_session(heroku_api_key, app_name, options)
+    async with aclosing(heroku_api.client.stream_lines(url)) as stream:
+        return [line async for line in stream]
+
+
+async def logs_command(client, message, app_name, heroku_api_key):
+    chat_id = message.chat.id
+    try:
+        options = parse_options(message.text)
+    except ValueError as e:
+        await message.reply(f'{e}\n\n{USAGE}')
+        return
+
+    if options['mode'] == 'help':
+        await message.reply(USAGE)
+        return
+
+    if options['mode'] == 'stop':
+        task = _tails.pop(chat_id, None)
+        if task is None:
+            await message.reply('No live log tail is running.')
+        else:
+            task.cancel()
+            await message.reply('Stopped following the logs.')
+        return
+
+    if options['mode'] == 'once':
+        try:
+            lines = await asyncio.wait_for(fetch_lines(heroku_api_key, app_name, options), 60)
+        except asyncio.TimeoutError:
+            await message.reply('Timed out fetching logs.')
+            return
+        if options['pattern']:
+            lines = [line for line in lines if options['pattern'].search(line)]
+        await message.reply(render(f'Logs of {app_name}:', lines))
+        return
+
+    if chat_id in _tails:
+        _tails.pop(chat_id).cancel()
+    status_message = await message.reply(f'Following logs of {app_name}…')
+    tail = LogTail(app_name, options, status_message)
+    task = asyncio.create_task(tail.run(heroku_api_key))
+    _tails[chat_id] = task
+    task.add_done_callback(lambda done: _tails.pop(chat_id, None) if _tails.get(chat_id) is done else None)
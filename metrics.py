@@ -0,0 +1,205 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event-loop lag samples
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+# Set to serve Prometheus text format on METRICS_HOST:METRICS_PORT
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= rank:
+                fraction = (rank - seen) / self.counts[i] if self.counts[i] else 0
+                return min(lower + (bound - lower) * fraction, self.max)
+            seen += self.counts[i]
+            lower = bound
+        return self.max
+
+
+class Series:
+    """Calls, errors and latency of one handler or one kind of external call."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def record(self, seconds, failed=False):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.latency.observe(seconds)
+
+
+handlers = {}
+external = {}
+loop_lag = Histogram()
+
+
+def instrument(func, name=None):
+    """Record calls, errors and latency of an update handler under `name` (default: its function name)."""
+    series = handlers.setdefault(name or func.__name__, Series())
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await func(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            series.record(time.perf_counter() - started, failed)
+
+    return wrapper
+
+
+class timed:
+    """Context manager timing one external call, e.g. `with metrics.timed('github', 'GET'):`."""
+
+    def __init__(self, service, operation):
+        self.series = external.setdefault((service, operation), Series())
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.series.record(time.perf_counter() - self.started, exc_type is not None)
+        return False
+
+
+def observe(service, operation, seconds):
+    """Record a duration measured elsewhere, such as time to first token."""
+    external.setdefault((service, operation), Series()).record(seconds)
+
+
+async def _sample_loop_lag():
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        # Anything past the requested sleep is time the loop was busy elsewhere
+        loop_lag.observe(max(0.0, time.monotonic() - started - LOOP_LAG_INTERVAL))
+
+
+def _line(name, labels, value):
+    label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+    return f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}'
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(_line(f'{name}_bucket', {**labels, 'le': bound}, cumulative))
+    lines.append(_line(f'{name}_bucket', {**labels, 'le': '+Inf'}, histogram.count))
+    lines.append(_line(f'{name}_sum', labels, f'{histogram.sum:.6f}'))
+    lines.append(_line(f'{name}_count', labels, histogram.count))
+    return lines
+
+
+def render_prometheus():
+    lines = ['# TYPE bot_handler_seconds histogram']
+    for name, series in sorted(handlers.items()):
+        lines += _histogram_lines('bot_handler_seconds', {'handler': name}, series.latency)
+    lines.append('# TYPE bot_handler_errors_total counter')
+    for name, series in sorted(handlers.items()):
+        lines.append(_line('bot_handler_errors_total', {'handler': name}, series.errors))
+    lines.append('# TYPE bot_external_seconds histogram')
+    for (service, operation), series in sorted(external.items()):
+        lines += _histogram_lines('bot_external_seconds', {'service': service, 'operation': operation}, series.latency)
+    lines.append('# TYPE bot_external_errors_total counter')
+    for (service, operation), series in sorted(external.items()):
+        lines.append(_line('bot_external_errors_total', {'service': service, 'operation': operation}, series.errors))
+    lines.append('# TYPE bot_event_loop_lag_seconds histogram')
+    lines += _histogram_lines('bot_event_loop_lag_seconds', {}, loop_lag)
+    return '\n'.join(lines) + '\n'
+
+
+def _summary_line(name, series):
+    latency = series.latency
+    return (f'{name}: {series.calls} calls, {series.errors} errors, '
+            f'p50 {latency.quantile(0.5) * 1000:.0f}ms, p95 {latency.quantile(0.95) * 1000:.0f}ms, '
+            f'max {latency.max * 1000:.0f}ms')
+
+
+def render_text():
+    lines = ['Handlers:']
+    lines += [_summary_line(name, series) for name, series in sorted(handlers.items()) if series.calls]
+    lines.append('\nExternal calls:')
+    lines += [_summary_line(f'{service} {operation}', series) for (service, operation), series in sorted(external.items())]
+    lines.append('\nEvent loop lag:')
+    lines.append(f'{loop_lag.count} samples, p50 {loop_lag.quantile(0.5) * 1000:.1f}ms, '
+                 f'p99 {loop_lag.quantile(0.99) * 1000:.1f}ms, max {loop_lag.max * 1000:.1f}ms')
+    return '\n'.join(lines)
+
+
+async def _serve_prometheus(reader, writer):
+    try:
+        # Only the request line matters; every path returns the same metrics
+        await reader.readline()
+        body = render_prometheus().encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n'
+                     b'Connection: close\r\n\r\n' + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+_tasks = []
+
+
+async def start():
+    """Start the loop-lag sampler and, if METRICS_PORT is set, the Prometheus endpoint."""
+    _tasks.append(asyncio.create_task(_sample_loop_lag()))
+    if METRICS_PORT:
+        server = await asyncio.start_server(_serve_prometheus, METRICS_HOST, int(METRICS_PORT))
+        _tasks.append(server)
+        logger.info('Serving metrics on http://%s:%s/metrics', METRICS_HOST, METRICS_PORT)
+
+
+async def stop():
+    for task in _tasks:
+        if isinstance(task, asyncio.Task):
+            task.cancel()
+        else:
+            task.close()
+    _tasks.clear()
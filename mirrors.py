@@ -0,0 +1,134 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import jobs
+
+logger = logging.getLogger(__name__)
+
+# Where bare mirrors live; point this at persistent disk to keep them across restarts
+MIRROR_ROOT = os.getenv('MIRROR_ROOT', os.path.join(tempfile.gettempdir(), 'bot-mirrors'))
+# Least recently used mirrors are deleted once they take up more than this
+MIRROR_MAX_BYTES = int(os.getenv('MIRROR_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+# Optional partial/shallow clone for big repos, e.g. MIRROR_FILTER=blob:none or MIRROR_DEPTH=50.
+# Deploys only archive the tip, so MIRROR_DEPTH=1 is enough for them; /clone then skips the mirror.
+MIRROR_FILTER = os.getenv('MIRROR_FILTER')
+MIRROR_DEPTH = os.getenv('MIRROR_DEPTH')
+
+
+def _disk_usage(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    """Bare mirrors keyed by repository URL, updated with incremental fetches."""
+
+    def __init__(self, root=MIRROR_ROOT, max_bytes=MIRROR_MAX_BYTES, clone_filter=MIRROR_FILTER, depth=MIRROR_DEPTH):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.clone_filter = clone_filter
+        self.depth = depth
+        self._locks = {}
+        self._in_use = {}
+
+    def path(self, url):
+        name = url.rstrip('/').split('/')[-1].replace('.git', '')
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.root, f'{name}-{digest}.git')
+
+    @property
+    def complete(self):
+        """Whether mirrors keep full history, so clones can borrow their objects with --reference."""
+        return not self.clone_filter and not self.depth
+
+    def _lock(self, path):
+        return self._locks.setdefault(path, asyncio.Lock())
+
+    async def update(self, url):
+        """Clone the mirror on first use, otherwise fetch only what changed. Returns its path."""
+        path = self.path(url)
+        async with self._lock(path):
+            if os.path.isdir(path):
+                args = ['git', 'fetch', '--prune', '--tags', 'origin']
+                if self.depth:
+                    args += ['--depth', str(self.depth)]
+                elif os.path.exists(os.path.join(path, 'shallow')):
+                    # Cloned while MIRROR_DEPTH was set; fetch the rest of the history
+                    args.append('--unshallow')
+                await jobs.run(args, cwd=path, check=True)
+            else:
+                os.makedirs(self.root, exist_ok=True)
+                args = ['git', 'clone', '--bare']
+                if self.clone_filter:
+                    args.append(f'--filter={self.clone_filter}')
+                if self.depth:
+                    args += ['--depth', str(self.depth)]
+                try:
+                    await jobs.run(args + [url, path], check=True)
+                    # A bare clone has no fetch refspec; track branches so later fetches update them
+                    await jobs.run(['git', 'config', 'remote.origin.fetch', '+refs/heads/*:refs/heads/*'],
+                                   cwd=path, check=True)
+                except BaseException:
+                    shutil.rmtree(path, ignore_errors=True)
+                    raise
+            # The directory mtime doubles as the last-used stamp for eviction
+            os.utime(path)
+        await self.evict()
+        return path
+
+    @contextlib.asynccontextmanager
+    async def hold(self, url):
+        """Update the mirror and keep it from being evicted until the block exits. Yields its path."""
+        path = self.path(url)
+        self._in_use[path] = self._in_use.get(path, 0) + 1
+        try:
+            await self.update(url)
+            yield path
+        finally:
+            self._release_use(path)
+
+    async def archive(self, url, dest, ref='HEAD'):
+        """Update the mirror and write `ref` as a .tar.gz to `dest`. Returns the commit it points at."""
+        async with self.hold(url) as path:
+            async with self._lock(path):
+                commit = await jobs.run(['git', 'rev-parse', ref], cwd=path, check=True)
+                await jobs.run(['git', 'archive', '--format=tar.gz', '-o', dest, ref], cwd=path, check=True)
+        return commit.stdout.strip()
+
+    def _release_use(self, path):
+        self._in_use[path] -= 1
+        if not self._in_use[path]:
+            del self._in_use[path]
+
+    async def evict(self):
+        if not os.path.isdir(self.root):
+            return
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                size = await asyncio.to_thread(_disk_usage, path)
+                mirrors.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in mirrors)
+        for _, size, path in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            if path in self._in_use or self._lock(path).locked():
+                continue
+            logger.info('Evicting repo mirror %s (%d bytes)', path, size)
+            await asyncio.to_thread(shutil.rmtree, path, True)
+            self._locks.pop(path, None)
+            total -= size
+
+
+cache = MirrorCache()
@@ -0,0 +1,145 @@
+import asyncio
+import io
+import os
+import secrets
+import time
+from collections import OrderedDict
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Characters of output per page (leaves room for the title and page counter)
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '3500'))
+# Outputs larger than this (bytes) are sent as a document instead of pages
+DOCUMENT_THRESHOLD = int(os.getenv('DOCUMENT_THRESHOLD', str(64 * 1024)))
+# How long (seconds) a paged output stays browsable, and how much is kept at most
+OUTPUT_TTL = float(os.getenv('OUTPUT_TTL', '900'))
+OUTPUT_MAX_ENTRIES = int(os.getenv('OUTPUT_MAX_ENTRIES', '100'))
+OUTPUT_MAX_CHARS = int(os.getenv('OUTPUT_MAX_CHARS', str(8 * 1024 * 1024)))
+
+TELEGRAM_LIMIT = 4096
+
+
+def page_offsets(text, size=PAGE_SIZE):
+    """Start offsets of each page, breaking at a newline where one is close to the limit."""
+    offsets = [0]
+    start = 0
+    while len(text) - start > size:
+        cut = text.rfind('\n', start, start + size)
+        end = cut + 1 if cut > start + size // 2 else start + size
+        offsets.append(end)
+        start = end
+    return offsets
+
+
+class PagedOutput:
+    def __init__(self, title, text):
+        self.title = title
+        self.text = text
+        self.offsets = page_offsets(text)
+        self.expires_at = time.monotonic() + OUTPUT_TTL
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def page(self, number):
+        start = self.offsets[number]
+        end = self.offsets[number + 1] if number + 1 < len(self.offsets) else len(self.text)
+        return self.text[start:end]
+
+
+class OutputStore:
+    """Outputs kept once so pages can be served without re-running anything; LRU with expiry."""
+
+    def __init__(self, max_entries=OUTPUT_MAX_ENTRIES, max_chars=OUTPUT_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._outputs = OrderedDict()
+        self._chars = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        for output_id in [key for key, output in self._outputs.items() if output.expires_at <= now]:
+            self._chars -= len(self._outputs.pop(output_id).text)
+
+    def add(self, output):
+        self._expire()
+        output_id = secrets.token_hex(4)
+        self._outputs[output_id] = output
+        self._chars += len(output.text)
+        while len(self._outputs) > self.max_entries or self._chars > self.max_chars:
+            _, old = self._outputs.popitem(last=False)
+            self._chars -= len(old.text)
+        return output_id
+
+    def get(self, output_id):
+        self._expire()
+        output = self._outputs.get(output_id)
+        if output is not None:
+            self._outputs.move_to_end(output_id)
+        return output
+
+
+outputs = OutputStore()
+
+
+def _render(output_id, output, number):
+    body = output.page(number).rstrip('\n')
+    text = f'{output.title}\n{body}\n\n[page {number + 1}/{len(output)}]'
+    buttons = []
+    if number > 0:
+        buttons.append(InlineKeyboardButton('« Prev', callback_data=f'page:{output_id}:{number - 1}'))
+    if number + 1 < len(output):
+        buttons.append(InlineKeyboardButton('Next »', callback_data=f'page:{output_id}:{number + 1}'))
+    return text, InlineKeyboardMarkup([buttons])
+
+
+async def send_or_defer(send, final=False):
+    """Await `send()` (an edit or reply), riding out Telegram's flood control.
+
+    Returns 0 once the text is shown, an unchanged edit included. On FloodWait a
+    non-final send is skipped and the wait in seconds is returned, so the caller
+    can catch up on a later update; a final one sleeps and retries.
+    """
+    while True:
+        try:
+            await send()
+            return 0
+        except MessageNotModified:
+            return 0
+        except FloodWait as e:
+            if not final:
+                return e.value
+            await asyncio.sleep(e.value)
+
+
+async def send_output(message, title, content, filename='output.txt'):
+    """Reply with `content` (str or bytes) in one message, as pages, or as a document when large."""
+    if len(content) > DOCUMENT_THRESHOLD:
+        data = content if isinstance(content, bytes) else content.encode('utf-8')
+        document = io.BytesIO(data)
+        document.name = filename
+        return await message.reply_document(document, caption=title[:1024])
+
+    text = content.decode('utf-8') if isinstance(content, bytes) else content
+    if len(title) + 1 + len(text) <= TELEGRAM_LIMIT:
+        return await message.reply(f'{title}\n{text}')
+
+    output = PagedOutput(title, text)
+    output_id = outputs.add(output)
+    page, markup = _render(output_id, output, 0)
+    return await message.reply(page, reply_markup=markup)
+
+
+async def handle_callback(client, callback_query):
+    _, output_id, number = callback_query.data.split(':')
+    output = outputs.get(output_id)
+    if output is None:
+        await callback_query.answer('This output has expired. Run the command again.', show_alert=True)
+        return
+    number = min(int(number), len(output) - 1)
+    page, markup = _render(output_id, output, number)
+    try:
+        await callback_query.message.edit_text(page, reply_markup=markup)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
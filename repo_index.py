@@ -0,0 +1,185 @@
+import asyncio
+import bisect
+import difflib
+import os
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+import github_api
+from github_api import api
+
+# Repositories per page when listing (GitHub's maximum)
+REPO_PAGE_SIZE = 100
+# Seconds between cheap refreshes (a conditional request for the most recently updated page)
+REPO_INDEX_TTL = float(os.getenv('REPO_INDEX_TTL', '60'))
+# Seconds between full reloads, which also notice deleted and renamed repositories
+REPO_INDEX_RELOAD = float(os.getenv('REPO_INDEX_RELOAD', '3600'))
+
+_LAST_PAGE = re.compile(r'<([^>]+)>;\s*rel="last"')
+_NEXT_PAGE = re.compile(r'<([^>]+)>;\s*rel="next"')
+
+
+class RepoIndex:
+    """One token's repositories, held in memory and sorted by name for prefix search."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        # full_name -> updated_at
+        self.repos = {}
+        # Sorted (lowercased short name, full_name) and (lowercased full_name, full_name), for bisect
+        self._names = []
+        self._full_names = []
+        self.etag = None
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self):
+        return self.loaded_at > 0
+
+    def _rebuild(self):
+        self._names = sorted((name.split('/', 1)[1].lower(), name) for name in self.repos)
+        self._full_names = sorted((name.lower(), name) for name in self.repos)
+
+    def _add(self, repos):
+        for repo in repos:
+            self.repos[repo['full_name']] = repo.get('updated_at') or ''
+
+    async def _get(self, url, params=None, extra_headers=None):
+        response = await api.get(url, headers={**self.headers, **(extra_headers or {})}, params=params)
+        if response.status_code not in (200, 304):
+            raise github_api.GitHubError(response.json().get('message') or f'HTTP {response.status_code}')
+        return response
+
+    async def _page(self, page, extra_headers=None):
+        params = {'per_page': REPO_PAGE_SIZE, 'page': page, 'sort': 'updated', 'direction': 'desc'}
+        return await self._get('/user/repos', params, extra_headers)
+
+    async def load(self):
+        """Fetch every page; after the first, the rest are requested concurrently."""
+        first = await self._page(1)
+        last = _LAST_PAGE.search(first.headers.get('Link', ''))
+        pages = int(parse_qs(urlparse(last.group(1)).query)['page'][0]) if last else 1
+        rest = await asyncio.gather(*[self._page(page) for page in range(2, pages + 1)])
+        self.repos = {}
+        for response in [first, *rest]:
+            self._add(response.json())
+        self._rebuild()
+        self.etag = first.headers.get('ETag')
+        self.loaded_at = self.refreshed_at = time.monotonic()
+
+    async def refresh(self):
+        """Pick up repositories created or updated since the last look.
+
+        The most recently updated page is requested with If-None-Match, so an
+        unchanged account costs a 304 and no rate limit. Otherwise newer pages
+        are followed only until they reach repositories the index already has.
+        Nothing changes unless every page loads.
+        """
+        first = await self._page(1, {'If-None-Match': self.etag} if self.etag else None)
+        if first.status_code == 304:
+            self.refreshed_at = time.monotonic()
+            return
+        newest = max(self.repos.values(), default='')
+        pages = []
+        response = first
+        while True:
+            repos = response.json()
+            pages.append(repos)
+            following = _NEXT_PAGE.search(response.headers.get('Link', ''))
+            # Sorted by update time, so once a page reaches known repos the rest are known too
+            if not following or not repos or repos[-1].get('updated_at', '') <= newest:
+                break
+            response = await self._get(following.group(1))
+        for repos in pages:
+            self._add(repos)
+        self._rebuild()
+        self.etag = first.headers.get('ETag')
+        self.refreshed_at = time.monotonic()
+
+    async def ensure(self, fresh=False):
+        """Load on first use; with `fresh`, also refresh when the index is older than REPO_INDEX_TTL."""
+        async with self._lock:
+            now = time.monotonic()
+            if not self.loaded or now - self.loaded_at > REPO_INDEX_RELOAD:
+                await self.load()
+            elif fresh and now - self.refreshed_at > REPO_INDEX_TTL:
+                await self.refresh()
+
+    def added(self, repo):
+        self._add([repo])
+        self._rebuild()
+
+    def names(self):
+        return sorted(self.repos, key=str.lower)
+
+    def prefix(self, query, limit=50):
+        """Repositories whose name (or full name, if the query has an owner) starts with `query`."""
+        query = query.lower()
+        entries = self._full_names if '/' in query else self._names
+        start = bisect.bisect_left(entries, (query, ''))
+        # Matches are contiguous in sorted order, so the scan never looks past `limit` entries
+        return [full_name for key, full_name in entries[start:start + limit] if key.startswith(query)]
+
+    def fuzzy(self, query, limit=10):
+        shorts = {}
+        for short, full_name in self._names:
+            shorts.setdefault(short, []).append(full_name)
+        close = difflib.get_close_matches(query.lower(), list(shorts), n=limit, cutoff=0.6)
+        return [full_name for short in close for full_name in shorts[short]][:limit]
+
+    def search(self, query, limit=50):
+        """Prefix matches first, then fuzzy ones for typos."""
+        matches = self.prefix(query, limit)
+        for name in self.fuzzy(query.split('/')[-1]):
+            if name not in matches and len(matches) < limit:
+                matches.append(name)
+        return matches
+
+    def resolve(self, name):
+        """Expand a short name like 'myrepo' to 'owner/myrepo'. Names with an owner pass through."""
+        if '/' in name:
+            return name
+        short = name.lower()
+        start = bisect.bisect_left(self._names, (short, ''))
+        exact = []
+        for candidate, full_name in self._names[start:]:
+            if candidate != short:
+                break
+            exact.append(full_name)
+        if len(exact) == 1:
+            return exact[0]
+        if len(exact) > 1:
+            raise ValueError(f"'{name}' is ambiguous: {', '.join(exact)}")
+        suggestions = self.fuzzy(name, 3)
+        if suggestions:
+            raise ValueError(f"No repository named '{name}'. Did you mean {', '.join(suggestions)}?")
+        raise ValueError(f"No repository named '{name}'. Use owner/name for repositories outside your account.")
+
+
+# Indexes by Authorization header, so each token sees its own repositories
+_indexes = {}
+
+
+def get(headers):
+    key = headers.get('Authorization')
+    if key not in _indexes:
+        _indexes[key] = RepoIndex(headers)
+    return _indexes[key]
+
+
+async def resolve(headers, name):
+    """Full name for `name`, from memory once the index has been loaded."""
+    if '/' in name:
+        return name
+    index = get(headers)
+    await index.ensure()
+    try:
+        return index.resolve(name)
+    except ValueError:
+        # Perhaps created since the last look; a refresh is usually a single 304
+        if time.monotonic() - index.refreshed_at < REPO_INDEX_TTL:
+            raise
+    await index.ensure(fresh=True)
+    return index.resolve(name)
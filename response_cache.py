@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+def normalize(prompt):
+    return ' '.join(prompt.lower().split())
+
+
+def make_key(kind, model, prompt):
+    return hashlib.sha256(f'{kind}\0{model}\0{normalize(prompt)}'.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """String values with a TTL, held in a bounded in-memory LRU and optionally mirrored to SQLite.
+
+    The on-disk tier survives restarts; entries found there are promoted back
+    into memory on first use.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400, path=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._db = None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path)
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache '
+                             '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, used_at REAL)')
+            self._db.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        item = self._memory.get(key)
+        if item is not None:
+            if item[1] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now:
+                self._db.execute('UPDATE cache SET used_at = ? WHERE key = ?', (now, key))
+                self._db.commit()
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, value, expires_at)
+        if self._db is None:
+            return
+        self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', (key, value, expires_at, now))
+        self._writes += 1
+        # Trim the disk tier now and then rather than on every write
+        if self._writes % 100 == 0:
+            self._db.execute('DELETE FROM cache WHERE expires_at < ?', (now,))
+            self._db.execute('DELETE FROM cache WHERE key NOT IN '
+                             '(SELECT key FROM cache ORDER BY used_at DESC LIMIT ?)', (self.max_disk_entries,))
+        self._db.commit()
+
+    def discard(self, key):
+        self._memory.pop(key, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._db.commit()
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'entries': len(self._memory),
+        }
+        if self._db is not None:
+            stats['disk_entries'] = self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return stats
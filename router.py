@@ -0,0 +1,77 @@
+import importlib
+import re
+from pyrogram import filters
+import metrics
+
+
+class Route:
+    """One command or trigger. A 'module:function' target is imported the first time it is used."""
+
+    def __init__(self, name, target, public=False):
+        self.name = name
+        self.target = target
+        self.public = public
+        self._handler = None
+
+    def handler(self):
+        if self._handler is None:
+            target = self.target
+            if isinstance(target, str):
+                module, _, function = target.partition(':')
+                target = getattr(importlib.import_module(module), function)
+            self._handler = metrics.instrument(target, self.name)
+        return self._handler
+
+
+class Router:
+    """Routes messages on a table built once at startup.
+
+    `filter` rejects everything that has no route (unknown commands, owner-only
+    commands from other users, plain text that is not a trigger) before
+    Pyrogram runs any handler; `dispatch` is the only message handler.
+    """
+
+    def __init__(self, owner_id, commands, public=(), triggers=None):
+        self.owner_id = owner_id
+        self.commands = {name.lower(): Route(name, target, name in public) for name, target in commands.items()}
+        # Triggers are phrases anywhere in the owner's text, matched case-insensitively
+        self.triggers = [(re.compile(re.escape(phrase), re.IGNORECASE), Route(phrase, target))
+                         for phrase, target in (triggers or {}).items()]
+
+        async def check(flt, client, message):
+            return self.match(message, client) is not None
+
+        self.filter = filters.create(check, 'RouterFilter')
+
+    def match(self, message, client=None):
+        user = message.from_user
+        if user is None:
+            return None
+        is_owner = user.id == self.owner_id
+        # Commands may come as a document caption (e.g. /batch with files attached)
+        text = message.text or message.caption
+        if not text:
+            return None
+        if text.startswith('/'):
+            words = text[1:].split(None, 1)
+            if not words:
+                return None
+            name, _, mention = words[0].partition('@')
+            me = getattr(client, 'me', None)
+            if mention and me is not None and me.username and mention.lower() != me.username.lower():
+                # /command@other_bot in a group is not for us
+                return None
+            route = self.commands.get(name.lower())
+            if route is not None and (route.public or is_owner):
+                return route
+            return None
+        if is_owner and message.text:
+            for pattern, route in self.triggers:
+                if pattern.search(message.text):
+                    return route
+        return None
+
+    async def dispatch(self, client, message):
+        route = self.match(message, client)
+        if route is not None:
+            await route.handler()(client, message)
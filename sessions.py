@@ -0,0 +1,187 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding per-user settings; on Heroku set DATABASE_URL instead, since the dyno disk is wiped on restart
+SESSION_DB = os.getenv('SESSION_DB', 'sessions.db')
+DATABASE_URL = os.getenv('DATABASE_URL')
+# Seconds a change may sit in memory before it is written out
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '2.0'))
+
+
+class MemoryBackend:
+    """Keeps nothing across restarts; for tests and local runs."""
+
+    def __init__(self):
+        self._rows = {}
+
+    def load(self, user_id):
+        data = self._rows.get(user_id)
+        return json.loads(data) if data is not None else None
+
+    def save_many(self, sessions):
+        for user_id, session in sessions.items():
+            self._rows[user_id] = json.dumps(session)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    def __init__(self, path=SESSION_DB):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The file holds API keys. SQLite gives the -wal and -shm files the database's mode,
+        # so it is made private before connecting; files left by older versions are tightened too
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        for name in (path, f'{path}-wal', f'{path}-shm'):
+            if os.path.exists(name):
+                os.chmod(name, 0o600)
+        # Flushes run in a worker thread, lookups on the event loop thread
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+            self._conn.commit()
+
+    def load(self, user_id):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, sessions):
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO sessions (user_id, data) VALUES (?, ?)',
+                [(user_id, json.dumps(session)) for user_id, session in sessions.items()]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresBackend:
+    """For Heroku Postgres (DATABASE_URL); needs psycopg2 installed.
+
+    Every row is read once at startup, so lookups never wait on the network
+    from the event loop.
+    """
+
+    def __init__(self, url=DATABASE_URL):
+        import psycopg2
+        self._conn = psycopg2.connect(url)
+        self._lock = threading.Lock()
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS bot_sessions (user_id BIGINT PRIMARY KEY, data TEXT NOT NULL)')
+            self._conn.commit()
+            cursor.execute('SELECT user_id, data FROM bot_sessions')
+            self._rows = {user_id: json.loads(data) for user_id, data in cursor.fetchall()}
+
+    def load(self, user_id):
+        # SessionStore keeps what it loads, so the preloaded copy is no longer needed
+        return self._rows.pop(user_id, None)
+
+    def save_many(self, sessions):
+        with self._lock, self._conn.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO bot_sessions (user_id, data) VALUES (%s, %s) '
+                'ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data',
+                [(user_id, json.dumps(session)) for user_id, session in sessions.items()]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """Per-user settings, loaded from the backend on first access and written behind.
+
+    get() returns a read-only view for one request; changes go through set()
+    so they are picked up by the next flush.
+    """
+
+    def __init__(self, backend, flush_interval=SESSION_FLUSH_INTERVAL):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._cache = {}
+        self._dirty = set()
+        self._flush_handle = None
+
+    def _load(self, user_id):
+        if user_id not in self._cache:
+            self._cache[user_id] = self.backend.load(user_id) or {}
+        return self._cache[user_id]
+
+    def get(self, user_id):
+        return dict(self._load(user_id))
+
+    def __contains__(self, user_id):
+        return bool(self._load(user_id))
+
+    def set(self, user_id, key, value):
+        self._load(user_id)[key] = value
+        self._dirty.add(user_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_now()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+
+    def _take_dirty(self):
+        self._flush_handle = None
+        dirty = {user_id: dict(self._cache[user_id]) for user_id in self._dirty}
+        self._dirty.clear()
+        return dirty
+
+    async def flush(self):
+        dirty = self._take_dirty()
+        if not dirty:
+            return
+        try:
+            await asyncio.to_thread(self.backend.save_many, dirty)
+        except Exception:
+            logger.exception('Saving sessions failed; will retry')
+            self._dirty.update(dirty)
+            self._schedule_flush()
+
+    def flush_now(self):
+        dirty = self._take_dirty()
+        if dirty:
+            self.backend.save_many(dirty)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self.flush_now()
+        self.backend.close()
+
+
+def make_backend():
+    if DATABASE_URL:
+        try:
+            return PostgresBackend(DATABASE_URL)
+        except ImportError:
+            logger.warning('DATABASE_URL is set but psycopg2 is not installed; keeping sessions in %s', SESSION_DB)
+    return SQLiteBackend(SESSION_DB)
+
+
+user_sessions = SessionStore(make_backend())
+atexit.register(user_sessions.flush_now)
@@ -0,0 +1,14 @@
+import subprocess
+import jobs
+import pager
+
+
+async def exec_command(client, message):
+    command = message.text.split(' ', 1)[1]
+    try:
+        result = await jobs.run(command, shell=True)
+        await pager.send_output(message, 'Command executed. Output:', result.stdout, 'output.txt')
+    except subprocess.TimeoutExpired:
+        await message.reply(f'Command timed out after {jobs.JOB_TIMEOUT:g} seconds.')
+    except Exception as e:
+        await message.reply(f'Error executing command: {str(e)}')
@@ -0,0 +1,13 @@
+"""Production entry point: one Telegram-facing dispatcher plus a pool of worker processes.
+
+The pool is started here, before main is imported, so spawned workers
+re-import only this file and start without the bot's client, settings or
+handlers. Size the pool with WORKER_PROCESSES (0 runs everything in the
+dispatcher); `python main.py` runs the bot without a pool.
+"""
+import workers
+
+if __name__ == '__main__':
+    workers.start()
+    import main
+    main.run()
@@ -0,0 +1,51 @@
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes for CPU-heavy work; 0 keeps everything in the bot process
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', str(os.cpu_count() or 1)))
+# Payloads smaller than this (bytes) are handled inline; shipping them to a worker costs more than it saves
+OFFLOAD_MIN_BYTES = int(os.getenv('OFFLOAD_MIN_BYTES', str(256 * 1024)))
+
+_pool = None
+
+
+def start():
+    """Start the worker pool. Called once by supervisor.py before it imports the bot."""
+    global _pool
+    if _pool is None and WORKER_PROCESSES > 0:
+        # 'spawn' so workers never inherit the event loop, sockets or threads of the dispatcher
+        _pool = ProcessPoolExecutor(WORKER_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def run(func, *args, size=0):
+    """Run `func(*args)` in a worker process when the payload is big enough, else inline.
+
+    `func` must be a module-level function so it can be sent to the worker.
+    """
+    if _pool is None or size < OFFLOAD_MIN_BYTES:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+
+# Work functions; these run inside the workers and must stay importable without the bot's settings
+
+def b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_contents(raw):
+    """Parse a contents API response and decode the file it carries. Returns (content, sha)."""
+    data = json.loads(raw)
+    return base64.b64decode(data.get('content', '')), data['sha']